@@ -0,0 +1,5 @@
+"""
+Benchmarks of wok builds, on synthetic sites of any size.
+
+Run them with `python -m benchmarks`. See `benchmarks/README.mkd`.
+"""
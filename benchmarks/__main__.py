@@ -0,0 +1,101 @@
+import os
+import sys
+import shutil
+import tempfile
+from optparse import OptionParser
+
+from wok import util
+from benchmarks import build, micro, regress, sitegen
+
+BASELINE = os.path.join(os.path.dirname(__file__), 'baseline.json')
+
+
+def parse_options(values):
+    """Parse `key=value` config overrides, with YAML values."""
+    options = {}
+    for value in values:
+        key, _, raw = value.partition('=')
+        options[key] = util.load_yaml(raw)
+    return options
+
+def main(argv):
+    parser = OptionParser(usage='%prog build [options]\n'
+                                '       %prog micro [options]\n'
+                                '       %prog check [options]')
+    parser.add_option('--pages', type='int', default=1000,
+            help="number of content pages in the synthetic site")
+    parser.add_option('--tags', type='int', default=100,
+            help="number of different tags")
+    parser.add_option('--tags-per-page', type='int', default=3)
+    parser.add_option('--categories', type='int', default=5,
+            help="number of subcategories of every category")
+    parser.add_option('--category-depth', type='int', default=2)
+    parser.add_option('--lists', type='int', default=10,
+            help="number of paginated list pages")
+    parser.add_option('--list-limit', type='int', default=20,
+            help="number of pages on every page of a list")
+    parser.add_option('--rst', type='float', default=0.2, dest='rst_fraction',
+            help="fraction of pages written in reStructuredText")
+    parser.add_option('--media', type='int', default=50, dest='media_files',
+            help="number of media files")
+    parser.add_option('--media-size', type='int', default=16384,
+            help="size of every media file in bytes")
+    parser.add_option('--site', dest='site',
+            help="generate the site in SITE and keep it, or build the "
+                 "site in SITE if it exists")
+    parser.add_option('--set', action='append', dest='config', default=[],
+            metavar='KEY=VALUE', help="override a setting of the site")
+    parser.add_option('--runs', type='int',
+            help="build RUNS times, without cleaning the output in between. "
+                 "With check, build every site RUNS times from scratch and "
+                 "keep the best result (default 3)")
+    parser.add_option('--no-profile', action='store_false', dest='profile',
+            default=True, help="don't time the phases of the build")
+    parser.add_option('--number', type='int', default=10000,
+            help="number of calls of every microbenchmark")
+    parser.add_option('--baseline', default=BASELINE,
+            help="baseline to check against (default %default)")
+    parser.add_option('--tolerance', type='float',
+            help="how much worse than the baseline results can be, as a "
+                 "fraction (default set in the baseline)")
+    parser.add_option('--update', action='store_true', default=False,
+            help="save the results of check as the new baseline")
+    opts, args = parser.parse_args(argv)
+
+    if args == ['micro']:
+        print micro.report(micro.run(opts.number))
+        return 0
+    if args == ['check']:
+        regressions = regress.check(opts.baseline, opts.tolerance,
+                opts.runs or 3, opts.update)
+        return 1 if regressions else 0
+    if args != ['build']:
+        parser.error('expected "build", "micro" or "check"')
+
+    path = opts.site or tempfile.mkdtemp(prefix='wok-bench-')
+    config = parse_options(opts.config)
+    try:
+        if not opts.site or not os.path.isdir(opts.site):
+            counts = sitegen.generate_site(path, pages=opts.pages,
+                    tags=opts.tags, tags_per_page=opts.tags_per_page,
+                    categories=opts.categories,
+                    category_depth=opts.category_depth, lists=opts.lists,
+                    list_limit=opts.list_limit,
+                    rst_fraction=opts.rst_fraction,
+                    media_files=opts.media_files,
+                    media_size=opts.media_size)
+            print ('Generated {markdown} Markdown pages, {rst} reST pages, '
+                   '{category} category pages, {list} lists and {media} '
+                   'media files in {0}'
+                   .format(path, **counts))
+
+        build.clean(path, config)
+        for run in xrange(opts.runs or 1):
+            print build.report(build.measure(path, config, opts.profile))
+    finally:
+        if not opts.site:
+            shutil.rmtree(path)
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
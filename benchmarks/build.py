@@ -0,0 +1,107 @@
+"""
+Time whole builds of a site.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+
+from wok.engine import Engine
+from wok.page import Page
+
+
+class BenchmarkEngine(Engine):
+    """An engine that keeps its profile instead of saving and printing it."""
+
+    def save_profile(self):
+        pass
+
+
+def build(path, options=None, profile=True):
+    """
+    Build the site at `path` in this process, with `options` overriding its
+    config. Returns the number of pages, the time taken, and the time of
+    every phase if `profile` is true.
+    """
+    Page.tmpl_env = None
+    engine = BenchmarkEngine.__new__(BenchmarkEngine)
+    engine.SITE_ROOT = os.path.abspath(path)
+    engine.option_overrides = options or {}
+    engine.profile = profile
+
+    start = time.time()
+    engine.generate_site()
+    seconds = time.time() - start
+
+    pages = len(engine.all_pages)
+    return {
+        'pages': pages,
+        'seconds': seconds,
+        'pages_per_second': pages / seconds,
+        'phases': engine.profiler.phases() if profile else [],
+    }
+
+def clean(path, options=None):
+    """Remove the output and cache of the site at `path`."""
+    options = options or {}
+    for name in (options.get('output_dir', 'output'),
+            options.get('cache_dir', '.wok-cache')):
+        target = os.path.join(path, name)
+        if os.path.islink(target):
+            os.unlink(target)
+        elif os.path.isdir(target):
+            shutil.rmtree(target)
+
+def peak_rss_kb(rusage):
+    # Linux gives the peak in kilobytes, OS X in bytes.
+    if sys.platform == 'darwin':
+        return rusage.ru_maxrss // 1024
+    return rusage.ru_maxrss
+
+def measure(path, options=None, profile=True):
+    """
+    Like `build`, but build in a child process, so that the CPU time and
+    peak memory use of the build, in kilobytes, can be added to the results.
+    """
+    read_fd, write_fd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(read_fd)
+        status = 0
+        try:
+            results = build(path, options, profile)
+            with os.fdopen(write_fd, 'w') as f:
+                json.dump(results, f)
+        except BaseException:
+            import traceback
+            traceback.print_exc()
+            status = 1
+        os._exit(status)
+
+    os.close(write_fd)
+    with os.fdopen(read_fd) as f:
+        data = f.read()
+    pid, status, rusage = os.wait4(pid, 0)
+    if status != 0:
+        raise RuntimeError('Building {0} failed'.format(path))
+
+    results = json.loads(data)
+    results['peak_rss_kb'] = peak_rss_kb(rusage)
+    # CPU time is less affected by whatever else the machine is doing.
+    results['cpu_seconds'] = rusage.ru_utime + rusage.ru_stime
+    results['pages_per_cpu_second'] = results['pages'] / \
+            results['cpu_seconds']
+    return results
+
+def report(results):
+    """Return a plain text report of the results of `measure`."""
+    lines = ['{0} pages in {1:.3f}s ({2:.3f}s CPU), {3:.1f} pages/s, '
+             'peak RSS {4:.1f} MB'.format(results['pages'],
+                 results['seconds'], results['cpu_seconds'],
+                 results['pages_per_second'],
+                 results['peak_rss_kb'] / 1024.0)]
+    for phase in results['phases']:
+        lines.append('  {0:<24} {1:>8.3f}s'.format(phase['name'],
+            phase['wall']))
+    return '\n'.join(lines)
@@ -0,0 +1,85 @@
+"""
+Microbenchmarks of the functions wok calls for every page.
+"""
+import os
+import shutil
+import tempfile
+import timeit
+from datetime import date, datetime
+
+from wok import util
+from wok.engine import Engine
+from wok.jinja import GlobFileLoader
+from wok.page import Author, Page
+from benchmarks.sitegen import write_templates
+
+
+def per_call(func, number, repeat=3):
+    """Return the best time of `repeat` runs of `func`, in microseconds."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1e6
+
+def bench_author_parse():
+    return lambda: Author.parse('Jane Doe <jane@example.com>')
+
+def bench_date_and_times():
+    def run():
+        util.date_and_times({'date': date(2012, 6, 1), 'time': 45296})
+        util.date_and_times({'datetime': datetime(2012, 6, 1, 12, 34, 56)})
+    return run
+
+def bench_build_meta():
+    engine = Engine.__new__(Engine)
+    engine.hooks = {}
+    options = dict(Engine.default_options)
+    Page.tmpl_env = None
+    Page.create_tmpl_env(options)
+
+    def run():
+        page = Page(options, engine)
+        page.meta = {
+            'title': 'A page about woks',
+            'tags': ['wok', 'cooking', 'kitchen'],
+            'author': 'Jane Doe <jane@example.com>',
+            'category': 'food/kitchen',
+            'datetime': datetime(2012, 6, 1, 12, 34, 56),
+        }
+        page.build_meta()
+    return run
+
+def bench_get_source(templates=50):
+    loader = GlobFileLoader(searchpath='templates', ignores=['*~'])
+    for i in xrange(templates):
+        with open(os.path.join('templates', 'extra{0}.html'.format(i)),
+                'w') as f:
+            f.write('{{ page.title }}')
+    return lambda: loader.get_source(None, 'default.*')
+
+BENCHMARKS = [
+    ('Author.parse', bench_author_parse),
+    ('util.date_and_times', bench_date_and_times),
+    ('Page.build_meta', bench_build_meta),
+    ('GlobFileLoader.get_source', bench_get_source),
+]
+
+def run(number=10000):
+    """
+    Run every microbenchmark `number` times. Returns a list of the name of
+    each benchmark and its time per call in microseconds.
+    """
+    orig_dir = os.getcwd()
+    tmp_path = tempfile.mkdtemp()
+    try:
+        # build_meta and the template loader need a template directory.
+        os.chdir(tmp_path)
+        write_templates(tmp_path)
+        return [(name, per_call(setup(), number))
+                for name, setup in BENCHMARKS]
+    finally:
+        Page.tmpl_env = None
+        os.chdir(orig_dir)
+        shutil.rmtree(tmp_path)
+
+def report(results):
+    """Return a plain text report of the results of `run`."""
+    return '\n'.join('{0:<28} {1:>10.2f} us'.format(name, usec)
+                     for name, usec in results)
@@ -0,0 +1,137 @@
+"""
+Compare build benchmarks against a stored baseline, to catch performance
+regressions.
+
+The baseline is a JSON file with the benchmark sites to build and the
+results they gave when the baseline was made:
+
+    {
+        "tolerance": 0.3,
+        "sites": {
+            "small": {
+                "generate": {"pages": 200},
+                "options": {},
+                "pages_per_cpu_second": 150.0,
+                "peak_rss_kb": 40000
+            },
+            ...
+        }
+    }
+
+`generate` holds the arguments of `sitegen.generate_site` and `options`
+the settings the site is built with. Throughput is measured in pages per
+second of CPU time, which varies less than wall time when the machine is
+busy. A site regresses if its throughput is more than `tolerance` lower than
+the baseline, or its peak memory use more than `tolerance` higher.
+
+The throughput of every site is also compared to that of the smallest site.
+Unlike the times themselves, that ratio doesn't depend much on the machine
+the benchmarks run on, and it drops when some part of the build gets slower
+than linear in the number of pages.
+"""
+import os
+import json
+import shutil
+import tempfile
+
+from benchmarks import build, sitegen
+
+
+def run_site(site, runs=3):
+    """
+    Generate and build a baseline `site` `runs` times. Returns the best
+    throughput and the lowest peak memory use of the runs.
+    """
+    path = tempfile.mkdtemp(prefix='wok-perf-')
+    try:
+        site_path = os.path.join(path, 'site')
+        sitegen.generate_site(site_path, **site.get('generate', {}))
+        results = []
+        for i in xrange(runs):
+            build.clean(site_path, site.get('options'))
+            results.append(build.measure(site_path, site.get('options'),
+                profile=False))
+    finally:
+        shutil.rmtree(path)
+
+    return {
+        'pages': results[0]['pages'],
+        'pages_per_cpu_second': round(max(r['pages_per_cpu_second']
+            for r in results), 1),
+        'peak_rss_kb': min(r['peak_rss_kb'] for r in results),
+    }
+
+def smallest(sites):
+    """The name of the site with the fewest pages."""
+    return min(sites, key=lambda name: sites[name]['pages'])
+
+def compare(baseline, results, tolerance):
+    """
+    Compare the `results` of every site with the `baseline`. Returns a list
+    of the regressions found, as messages.
+    """
+    regressions = []
+    expected = baseline['sites']
+    for name in sorted(results):
+        base = expected[name]
+        result = results[name]
+        if result['pages_per_cpu_second'] < base['pages_per_cpu_second'] * \
+                (1 - tolerance):
+            regressions.append('{0}: {1:.1f} pages/CPU s, baseline {2:.1f}'
+                    .format(name, result['pages_per_cpu_second'],
+                        base['pages_per_cpu_second']))
+        if result['peak_rss_kb'] > base['peak_rss_kb'] * (1 + tolerance):
+            regressions.append('{0}: peak RSS {1} kB, baseline {2} kB'
+                    .format(name, result['peak_rss_kb'], base['peak_rss_kb']))
+
+    if len(results) < 2:
+        return regressions
+
+    ref = smallest(results)
+    for name in sorted(results):
+        if name == ref:
+            continue
+        ratio = results[name]['pages_per_cpu_second'] / \
+                results[ref]['pages_per_cpu_second']
+        base_ratio = expected[name]['pages_per_cpu_second'] / \
+                expected[ref]['pages_per_cpu_second']
+        if ratio < base_ratio * (1 - tolerance):
+            regressions.append('{0}: {1:.2f} times the throughput of {2}, '
+                    'baseline {3:.2f}'.format(name, ratio, ref, base_ratio))
+    return regressions
+
+def check(baseline_path, tolerance=None, runs=3, update=False):
+    """
+    Build every site in the baseline at `baseline_path` and compare the
+    results with it, printing a report. With `update`, the baseline is
+    replaced with the results instead. Returns the regressions found.
+    """
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    if tolerance is None:
+        tolerance = baseline.get('tolerance', 0.3)
+
+    results = {}
+    for name in sorted(baseline['sites']):
+        results[name] = run_site(baseline['sites'][name], runs)
+        base = baseline['sites'][name]
+        print '{0:<10} {1:>6} pages  {2:>8.1f} pages/CPU s ({3:>8.1f})  ' \
+              '{4:>8} kB ({5:>8})'.format(name, results[name]['pages'],
+                results[name]['pages_per_cpu_second'],
+                base.get('pages_per_cpu_second', 0),
+                results[name]['peak_rss_kb'], base.get('peak_rss_kb', 0))
+
+    if update:
+        for name, result in results.iteritems():
+            baseline['sites'][name].update(result)
+        with open(baseline_path, 'w') as f:
+            json.dump(baseline, f, indent=4, sort_keys=True,
+                    separators=(',', ': '))
+            f.write('\n')
+        print 'Updated {0}'.format(baseline_path)
+        return []
+
+    regressions = compare(baseline, results, tolerance)
+    for message in regressions:
+        print 'Regression: ' + message
+    return regressions
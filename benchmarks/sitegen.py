@@ -0,0 +1,223 @@
+"""
+Generate synthetic wok sites of any size, to measure how builds scale.
+
+The sites are made from a seeded random number generator, so the same
+arguments always give the same site.
+"""
+import os
+import random
+import shutil
+from datetime import datetime, timedelta
+
+import yaml
+
+WORDS = ('wok stir fry noodle garlic ginger sesame pepper onion carrot '
+         'cabbage tofu rice sauce steam boil heat oil pan flame quick slow '
+         'crisp tender sweet sour salty spicy fresh bowl plate serve').split()
+
+TEMPLATES = {
+    'base.html': '''<!DOCTYPE html>
+<html>
+<head><title>{{ page.title }} - {{ site.title }}</title></head>
+<body>
+<nav>
+{% for category in site.categories %}<a href="/{{ category }}/">{{ category }}</a>
+{% endfor %}
+</nav>
+{% block body %}{% endblock %}
+</body>
+</html>
+''',
+    'default.html': '''{% extends "base.html" %}
+{% block body %}
+<h1>{{ page.title }}</h1>
+<p>By {{ page.author.name }} on {{ page.date }}</p>
+<ul>
+{% for tag in page.tags %}<li>{{ tag }} ({{ site.tag_counts[tag] }})</li>
+{% endfor %}
+</ul>
+{{ page.content }}
+{% endblock %}
+''',
+    'list.html': '''{% extends "base.html" %}
+{% block body %}
+<h1>{{ page.title }}</h1>
+{% for item in pagination.page_items %}
+<h2><a href="{{ item.url }}">{{ item.title }}</a></h2>
+{{ item.preview }}
+{% endfor %}
+{% if pagination.prev_page %}<a href="{{ pagination.prev_page.url }}">Newer</a>{% endif %}
+{% if pagination.next_page %}<a href="{{ pagination.next_page.url }}">Older</a>{% endif %}
+{% endblock %}
+''',
+}
+
+
+def sentence(rand, n=12):
+    words = [rand.choice(WORDS) for i in xrange(n)]
+    return ' '.join(words).capitalize() + '.'
+
+def paragraph(rand, n=5):
+    return ' '.join(sentence(rand) for i in xrange(n))
+
+def markdown_body(rand, paragraphs):
+    parts = []
+    for i in xrange(paragraphs):
+        if i % 3 == 1:
+            parts.append('## ' + sentence(rand, 4))
+        parts.append(paragraph(rand).replace(' wok ', ' *wok* ', 1))
+        if i % 4 == 2:
+            parts.append('\n'.join('- ' + sentence(rand, 6) for j in xrange(4)))
+    return '\n\n'.join(parts)
+
+def rst_body(rand, paragraphs):
+    parts = []
+    for i in xrange(paragraphs):
+        if i % 3 == 1:
+            title = sentence(rand, 4)
+            parts.append(title + '\n' + '-' * len(title))
+        parts.append(paragraph(rand).replace(' wok ', ' **wok** ', 1))
+        if i % 4 == 2:
+            parts.append('\n'.join('* ' + sentence(rand, 6) for j in xrange(4)))
+    return '\n\n'.join(parts)
+
+def write_templates(path):
+    """Write the templates of a synthetic site to `path`/templates."""
+    templates = os.path.join(path, 'templates')
+    if not os.path.isdir(templates):
+        os.makedirs(templates)
+    for name, source in TEMPLATES.iteritems():
+        with open(os.path.join(templates, name), 'w') as f:
+            f.write(source)
+
+def category_paths(categories, depth):
+    """
+    Return every category path of a tree `categories` wide and `depth` deep,
+    parents first. Every category has a name of its own, like `cat1-2`.
+    """
+    paths = []
+    level = [[]]
+    for i in xrange(depth):
+        level = [p + ['-'.join([p[-1] if p else 'cat', str(j)])]
+                 for p in level for j in xrange(categories)]
+        paths.extend(level)
+    return paths
+
+def write_page(path, meta, preview='', body=''):
+    with open(path, 'w') as f:
+        yaml.safe_dump(meta, f, default_flow_style=False)
+        if preview:
+            f.write('---\n{0}\n---\n{1}\n'.format(preview, body))
+        else:
+            f.write('---\n{0}\n'.format(body))
+
+def generate_site(path, pages=1000, tags=100, tags_per_page=3, categories=5,
+        category_depth=2, lists=10, list_limit=20, rst_fraction=0.2,
+        paragraphs=6, media_files=50, media_size=16384, config=None, seed=0):
+    """
+    Write a synthetic site to `path`, which is removed first if it exists.
+
+    The site has `pages` content pages, a `rst_fraction` of them in
+    reStructuredText and the rest in Markdown, each with `tags_per_page`
+    of `tags` tags and in one of the leaves of a category tree
+    `categories` wide and `category_depth` deep, which has a page for every
+    category. There are `lists`
+    paginated list pages, one of every page and the others of a tag each,
+    with `list_limit` pages per page, and `media_files` media files of
+    `media_size` bytes. `config` is added to the site's config.
+
+    Returns the number of pages of each kind that were written.
+    """
+    rand = random.Random(seed)
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+
+    site_config = {
+        'site_title': 'Synthetic site',
+        'author': 'Synthetic Author <author@example.com>',
+        'url_pattern': '/{category}/{slug}{page}.{ext}',
+    }
+    site_config.update(config or {})
+    with open(os.path.join(path, 'config'), 'w') as f:
+        yaml.safe_dump(site_config, f, default_flow_style=False)
+
+    write_templates(path)
+
+    content = os.path.join(path, 'content')
+    os.makedirs(content)
+    start = datetime(2010, 1, 1)
+    counts = {'markdown': 0, 'rst': 0, 'category': 0, 'list': 0, 'media': 0}
+
+    # Every category needs a page of its own, or its pages are orphans.
+    cats = category_paths(categories, category_depth if categories else 0)
+    for cat in cats:
+        os.makedirs(os.path.join(content, *cat))
+        meta = {
+            'title': 'Category ' + cat[-1],
+            'slug': cat[-1],
+            'datetime': start,
+        }
+        if len(cat) > 1:
+            meta['category'] = '/'.join(cat[:-1])
+        write_page(os.path.join(content, *cat) + '.mkd', meta,
+                body=paragraph(rand))
+        counts['category'] += 1
+    leaves = [cat for cat in cats if len(cat) == category_depth] or [[]]
+
+    tag_names = ['tag{0}'.format(i) for i in xrange(tags)]
+    authors = ['Author {0} <author{0}@example.com>'.format(i)
+               for i in xrange(10)]
+
+    for i in xrange(pages):
+        rst = rand.random() < rst_fraction
+        category = rand.choice(leaves)
+        meta = {
+            'title': sentence(rand, 5)[:-1],
+            'slug': 'page{0}'.format(i),
+            'tags': rand.sample(tag_names, min(tags_per_page, tags)),
+            'author': rand.choice(authors),
+            'datetime': start + timedelta(hours=7 * i),
+        }
+        if category:
+            meta['category'] = '/'.join(category)
+        if rst:
+            body, ext = rst_body(rand, paragraphs), 'rst'
+            counts['rst'] += 1
+        else:
+            body, ext = markdown_body(rand, paragraphs), 'mkd'
+            counts['markdown'] += 1
+        write_page(os.path.join(content, *(category +
+            ['page{0}.{1}'.format(i, ext)])), meta, paragraph(rand, 2), body)
+
+    for i in xrange(lists):
+        if i == 0 or not tags:
+            source, title = 'site.pages', 'All pages'
+        else:
+            tag = tag_names[(i - 1) % tags]
+            source, title = 'site.tags.' + tag, 'Tagged ' + tag
+        write_page(os.path.join(content, 'list{0}.mkd'.format(i)), {
+            'title': title,
+            'slug': 'list{0}'.format(i),
+            'type': 'list',
+            'datetime': start,
+            'pagination': {
+                'list': source,
+                'limit': list_limit,
+                'sort_key': 'datetime',
+                'sort_reverse': True,
+            },
+        })
+        counts['list'] += 1
+
+    media = os.path.join(path, 'media')
+    for i in xrange(media_files):
+        directory = os.path.join(media, 'dir{0}'.format(i % 10))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(os.path.join(directory, 'file{0}.bin'.format(i)), 'wb') as f:
+            f.write(('%0*x' % (media_size * 2,
+                rand.getrandbits(media_size * 8))).decode('hex'))
+        counts['media'] += 1
+
+    return counts
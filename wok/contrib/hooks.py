@@ -112,8 +112,12 @@ def compile_sass(config, output_dir):
                     return
 
                 compiled_str = sass.compile(filename=sass_src, output_style='compressed')
-                with open(sass_dest, 'w') as f:
+                # Replace the file instead of writing into it, it may be a
+                # hard link to the live site with `staged_output`.
+                tmp_dest = sass_dest + '.tmp'
+                with open(tmp_dest, 'w') as f:
                     f.write(compiled_str)
+                os.rename(tmp_dest, sass_dest)
 
     # TODO: Get rid of extra housekeeping by compiling Sass files in
     #   "site.output.pre" hook
@@ -6,13 +6,19 @@ import fnmatch
 from datetime import datetime
 from optparse import OptionParser, OptionGroup
 import logging
+import multiprocessing
 
 import yaml
+import jinja2
 
 import wok
 from wok.page import Page, Author
 from wok import renderers
 from wok import util
+from wok import media
+from wok.manifest import BuildManifest, digest, digest_tree
+from wok.jinja import compile_templates
+from wok.profiler import Profiler, null_span
 from wok.dev_server import dev_server
 
 import locale
@@ -36,8 +42,26 @@ class Engine(object):
         'markdown_extra_plugins': [],
         'ignore_files': [],
         'rst_doctitle': False,
+        'cache_dir': '.wok-cache',
+        'incremental': False,
+        'media_sync': False,
+        'media_sync_checksum': False,
+        'media_copy_mode': 'copy',
+        'jobs': 1,
+        'renderer_cache': False,
+        'renderer_cache_size': 100,
+        'staged_output': False,
+        'lazy_markup': False,
+        'template_cache': False,
+        'compiled_templates': None,
+        'stream_output': False,
+        'low_memory': False,
     }
     SITE_ROOT = os.getcwd()
+    option_overrides = {}
+    profile = False
+    profiler = None
+    spool = None
 
     def __init__(self, output_lvl=1):
         """
@@ -74,6 +98,27 @@ class Engine(object):
                 help="specify PORT on which to run development server")
         parser.add_option_group(devserver_grp)
 
+        # Options that change how the site is built
+        build_grp = OptionGroup(parser, "Build",
+                "These override the matching settings in the config file.")
+        build_grp.add_option('--incremental', action='store_true',
+                dest='incremental',
+                help="only rebuild pages whose source, templates or config "
+                "changed since the last build")
+        build_grp.add_option('--jobs', '-j', action='store', dest='jobs',
+                type='int', metavar='N',
+                help="render pages with N processes at once (0 to use one "
+                "per CPU)")
+        build_grp.add_option('--compile-templates', action='store_true',
+                dest='compile_templates',
+                help="compile the templates into the compiled_templates file "
+                "set in the config file before generating the site")
+        build_grp.add_option('--profile', action='store_true',
+                dest='profile',
+                help="time the phases of the build and every page, and save "
+                "the results in the cache directory")
+        parser.add_option_group(build_grp)
+
         # Options for noisiness level and logging
         logging_grp = OptionGroup(parser, "Logging",
                 "By default, log messages will be sent to standard out, "
@@ -97,6 +142,13 @@ class Engine(object):
 
         cli_options, args = parser.parse_args()
 
+        self.option_overrides = {}
+        if cli_options.incremental:
+            self.option_overrides['incremental'] = True
+        if cli_options.jobs is not None:
+            self.option_overrides['jobs'] = cli_options.jobs
+        self.profile = bool(cli_options.profile)
+
         # Set up logging
         # --------------
         logging_options = {
@@ -126,7 +178,7 @@ class Engine(object):
             # read old config if present
             if os.path.isfile('config'):
                 with open('config') as f:
-                    yaml_config = yaml.load(f)
+                    yaml_config = util.load_yaml(f)
 
                 if yaml_config:
                     options.update(yaml_config)
@@ -136,7 +188,7 @@ class Engine(object):
 
             # save new config
             with open('config', 'w') as f:
-                    yaml.dump(options, f)
+                    yaml.safe_dump(options, f)
 
             # create required dirs
 
@@ -149,6 +201,8 @@ class Engine(object):
 
         # Action!
         # -------
+        if cli_options.compile_templates:
+            self.compile_templates()
         self.generate_site()
 
         # Dev server
@@ -171,29 +225,89 @@ class Engine(object):
                 change_handler=self.generate_site)
             server.run()
 
+    def compile_templates(self):
+        """
+        Compile the templates in the template directory into the file or
+        directory set by `compiled_templates`, so later builds don't have to
+        compile them.
+        """
+        orig_dir = os.getcwd()
+        os.chdir(self.SITE_ROOT)
+
+        self.read_options()
+        target = self.options['compiled_templates']
+        if not target:
+            logging.critical('Set compiled_templates in the config file to '
+                    'where the compiled templates should go. Aborting.')
+            sys.exit(1)
+
+        options = dict(self.options, compiled_templates=None)
+        env = jinja2.Environment(loader=Page.template_loader(options),
+                extensions=self.options.get('jinja2_extensions', []))
+        names = compile_templates(env, target, self.options['ignore_files'])
+        logging.info('Compiled {0} templates into {1}'.format(len(names),
+            target))
+
+        # Load the compiled templates from now on.
+        Page.tmpl_env = None
+        os.chdir(orig_dir)
+
     def generate_site(self):
         ''' Generate the wok site '''
         orig_dir = os.getcwd()
         os.chdir(self.SITE_ROOT)
 
         self.all_pages = []
+        self.profiler = Profiler() if self.profile else None
 
-        self.read_options()
-        self.sanity_check()
-        self.load_hooks()
-        self.load_renderers()
-        self.renderer_options()
+        try:
+            self.run_phases(self.read_options, self.sanity_check,
+                    self.load_hooks, self.load_renderers,
+                    self.renderer_options, self.load_manifest)
 
-        self.run_hook('site.start')
+            self.run_hook('site.start')
 
-        self.prepare_output()
-        self.load_pages()
-        self.make_tree()
-        self.render_site()
+            self.run_phases(self.prepare_output, self.load_pages,
+                    self.make_tree, self.render_site, self.save_manifest,
+                    self.prune_caches, self.swap_output)
 
-        self.run_hook('site.done')
+            self.run_hook('site.done')
+        finally:
+            # Pages read their text from the spool up to the end of the build.
+            if self.spool is not None:
+                self.spool.close()
+                self.spool = None
 
-        os.chdir(orig_dir)
+            # The profile of a failed build shows how far it got.
+            if self.profiler is not None:
+                self.save_profile()
+
+            os.chdir(orig_dir)
+
+    def run_phases(self, *phases):
+        """Run the given methods in order, timing each when profiling."""
+        for phase in phases:
+            with self.span(phase.__name__):
+                phase()
+
+    def span(self, name, category='phase', page=None):
+        """
+        Time a `with` block in the profile, if the build is profiled. See
+        `Profiler.span`.
+        """
+        if self.profiler is None:
+            return null_span
+        return self.profiler.span(name, category, page)
+
+    def save_profile(self):
+        """Save the profile of the build, and print a summary of it."""
+        profile_path, trace_path, hooks_path = self.profiler.save(
+                os.path.join(self.options['cache_dir'], 'profile'))
+        print self.profiler.report()
+        print
+        print 'Saved the profile to {0}'.format(profile_path)
+        print 'Saved the trace to {0}'.format(trace_path)
+        print 'Saved the hook stats to {0}'.format(hooks_path)
 
     def read_options(self):
         """Load options from the config file."""
@@ -201,11 +315,21 @@ class Engine(object):
 
         if os.path.isfile('config'):
             with open('config') as f:
-                yaml_config = yaml.load(f)
+                yaml_config = util.load_yaml(f)
 
             if yaml_config:
                 self.options.update(yaml_config)
 
+        self.options.update(self.option_overrides)
+
+        if not self.options['jobs']:
+            self.options['jobs'] = multiprocessing.cpu_count()
+        # Pages can only be released once written by the serial renderer.
+        if self.options['low_memory'] and self.options['jobs'] > 1:
+            logging.warning('low_memory renders the pages one at a time, '
+                    'ignoring jobs: {0}.'.format(self.options['jobs']))
+            self.options['jobs'] = 1
+
         # Make authors a list, even only a single author was specified.
         authors = self.options.get('authors', self.options.get('author', None))
         if isinstance(authors, list):
@@ -224,6 +348,20 @@ class Engine(object):
                     'of {type} in the url pattern specified in the config '
                     'file.')
 
+        if self.options['media_copy_mode'] not in media.modes:
+            logging.warn('Unknown media_copy_mode `{0}`, copying media '
+                    'instead. Valid modes are {1}.'.format(
+                        self.options['media_copy_mode'], ', '.join(media.modes)))
+            self.options['media_copy_mode'] = 'copy'
+
+        if self.options['staged_output'] is True:
+            self.options['staged_output'] = 'rename'
+        if self.options['staged_output'] not in (False, 'rename', 'symlink'):
+            logging.warn('Unknown staged_output `{0}`, writing to the output '
+                    'directory directly instead. Valid values are rename and '
+                    'symlink.'.format(self.options['staged_output']))
+            self.options['staged_output'] = False
+
         # Set locale if needed
         wanted_locale = self.options.get('locale')
         if wanted_locale is not None:
@@ -243,10 +381,13 @@ class Engine(object):
         # Markdown extra plugins
         markdown_extra_plugins = \
             self.options.get('markdown_extra_plugins', [])
+        # Don't add them again when the dev server rebuilds the site.
         if hasattr(renderers, 'Markdown'):
-            renderers.Markdown.plugins.extend(markdown_extra_plugins)
+            renderers.Markdown.plugins.extend(p for p in markdown_extra_plugins
+                    if p not in renderers.Markdown.plugins)
         if hasattr(renderers, 'Markdown2'):
-            renderers.Markdown2.extras.extend(markdown_extra_plugins)
+            renderers.Markdown2.extras.extend(p for p in markdown_extra_plugins
+                    if p not in renderers.Markdown2.extras)
 
         # reStructuredText options
         if hasattr(renderers, 'ReStructuredText'):
@@ -254,6 +395,14 @@ class Engine(object):
                 {'doctitle' : self.options.get('rst_doctitle', False), \
                 })
 
+        # Cache of rendered markup
+        if self.options['renderer_cache']:
+            renderers.cache = renderers.RenderCache(
+                    os.path.join(self.options['cache_dir'], 'renderers'),
+                    self.options['renderer_cache_size'] * 1024 * 1024)
+        else:
+            renderers.cache = None
+
     def sanity_check(self):
         """Basic sanity checks."""
         # Make sure that this is (probabably) a wok source directory.
@@ -297,19 +446,74 @@ class Engine(object):
         """ Run specified hooks if they exist """
         logging.debug('Running hook {0}'.format(hook_name))
         returns = []
+        # Hooks run on a page count towards the time of that page.
+        page = None
+        if self.profiler is None:
+            stats = None
+        else:
+            stats = self.profiler.hooks
+            if hook_name.startswith('page.') and args:
+                page = args[0].profile_name()
         try:
             for hook in self.hooks.get(hook_name, []):
-                returns.append(hook(self.options, *args))
+                if stats is None:
+                    returns.append(hook(self.options, *args))
+                    continue
+                with self.span(hook_name, 'hook', page):
+                    returns.append(stats.call(hook_name, hook, self.options,
+                        *args))
         except AttributeError:
             logging.info('Hook {0} not defined'.format(hook_name))
         return returns
 
+    def has_hook(self, hook_name):
+        """Whether any hooks are defined for `hook_name`."""
+        return bool(getattr(self, 'hooks', {}).get(hook_name))
+
+    def load_manifest(self):
+        """
+        Load the manifest of the previous build, if this is an incremental
+        build or media is synced.
+
+        In incremental builds, pages are rebuilt when their source, their renderer, the config, the
+        templates, the hooks, the renderers or the metadata of any page in the
+        site changed, or when the source of a page whose `content` or
+        `preview` their templates showed changed. Pages with pagination are
+        always rebuilt. Pages whose hooks use the content of other pages can
+        opt out with `incremental: false`.
+        """
+        self.manifest = None
+        self.fresh_pages = {}
+        if not (self.options['incremental'] or self.options['media_sync']):
+            return
+
+        self.manifest = BuildManifest.load(
+                os.path.join(self.options['cache_dir'], 'manifest.json'),
+                self.options['output_dir'])
+        self.env_digest = digest(wok.version,
+                repr(sorted(self.options.items())),
+                digest_tree(self.options['template_dir'], 'hooks',
+                    'renderers', self.options['compiled_templates'] or ''))
+
     def prepare_output(self):
         """
         Prepare the output directory. Remove any contents there already, and
         then copy over the media files, if they exist.
+
+        Incremental builds and builds that sync media keep the previous
+        output, unless there is no manifest to tell which files in it are
+        stale. Only the media files that changed are copied then, and media
+        files that are gone from the media directory are removed at the end of
+        the build.
+
+        Staged builds do all of this in the staging directory instead.
         """
-        if os.path.isdir(self.options['output_dir']):
+        self.stage_output()
+        keep_output = bool(self.manifest)
+
+        if os.path.isdir(self.options['output_dir']) and keep_output:
+            logging.info('Keeping the output of the previous build.')
+        elif os.path.isdir(self.options['output_dir']):
             for name in os.listdir(self.options['output_dir']):
                 # Don't remove dotfiles
                 if name[0] == ".":
@@ -325,7 +529,25 @@ class Engine(object):
         self.run_hook('site.output.pre', self.options['output_dir'])
 
         # Copy the media directory to the output folder
-        if os.path.isdir(self.options['media_dir']):
+        sync_media = (self.manifest is not None
+                or self.options['media_copy_mode'] != 'copy')
+        if os.path.isdir(self.options['media_dir']) and sync_media:
+            try:
+                deployed, updated = media.sync_tree(self.options['media_dir'],
+                        self.options['output_dir'],
+                        checksum=self.options['media_sync_checksum'],
+                        mode=self.options['media_copy_mode'])
+                if self.manifest is not None:
+                    self.manifest.record_media(deployed)
+                logging.info('Deployed {0} of {1} media files.'.format(
+                    updated, len(deployed)))
+            except OSError:
+                logging.warning('There was a problem copying the media files '
+                                'to the output directory.')
+
+            self.run_hook('site.output.post', self.options['output_dir'])
+
+        elif os.path.isdir(self.options['media_dir']):
             try:
                 for name in os.listdir(self.options['media_dir']):
                     path = os.path.join(self.options['media_dir'], name)
@@ -346,14 +568,141 @@ class Engine(object):
 
             self.run_hook('site.output.post', self.options['output_dir'])
 
+    def stage_output(self):
+        """
+        Point the build at a staging directory next to the output directory,
+        if `staged_output` is set. When the previous output is kept, the
+        staging directory is seeded with hard links to its files, so
+        unchanged files don't have to be copied, and `swap_output` puts it
+        live at the end of the build. Otherwise only the dotfiles that
+        `prepare_output` would keep are linked.
+
+        Pages and media files are always replaced, never written into, so the
+        live files the staging directory links to are left alone. Hooks that
+        change files in the output directory have to replace them as well.
+        """
+        self.live_output_dir = None
+        mode = self.options['staged_output']
+        if not mode:
+            return
+
+        live = os.path.normpath(self.options['output_dir'])
+        if mode == 'rename':
+            staging = live + '.staging'
+        else:
+            staging = os.path.join(live + '.builds',
+                    datetime.now().strftime('%Y%m%d-%H%M%S-%f'))
+
+        # Left over from a build that failed.
+        media.remove(staging)
+        if os.path.isdir(live) and self.manifest:
+            media.sync_tree(live, staging, mode='hardlink')
+        else:
+            os.makedirs(staging)
+            names = os.listdir(live) if os.path.isdir(live) else []
+            for name in names:
+                if name[0] != '.':
+                    continue
+                path = os.path.join(live, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    media.sync_tree(path, os.path.join(staging, name),
+                            mode='hardlink')
+                else:
+                    media.deploy_file(path, os.path.join(staging, name),
+                            mode='hardlink')
+        logging.info('Staging the output in {0}'.format(staging))
+
+        self.live_output_dir = live
+        self.options['output_dir'] = staging
+        if self.manifest is not None:
+            self.manifest.root = staging
+
+    def swap_output(self):
+        """
+        Put the staging directory live in place of the output directory.
+
+        With `staged_output: rename` the old output directory is renamed out
+        of the way and the staging directory renamed to take its place, so for
+        a moment there is no output directory. With `staged_output: symlink`
+        the output directory is a symlink to the latest build, which is
+        replaced atomically. The previous build is
+        kept, and older ones removed.
+        """
+        if self.live_output_dir is None:
+            return
+
+        live = self.live_output_dir
+        staging = self.options['output_dir']
+        self.options['output_dir'] = live
+        if self.manifest is not None:
+            self.manifest.root = live
+
+        if self.options['staged_output'] == 'rename':
+            old = live + '.old'
+            media.remove(old)
+            if os.path.lexists(live):
+                os.rename(live, old)
+            os.rename(staging, live)
+            media.remove(old)
+
+        else:
+            builds = os.path.dirname(staging)
+            previous = None
+            if os.path.islink(live):
+                previous = os.path.join(os.path.dirname(live),
+                        os.readlink(live))
+            elif os.path.isdir(live):
+                # Not a staged build yet. Move it out of the way once, so it
+                # can be replaced by a symlink.
+                previous = os.path.join(builds, 'previous')
+                media.remove(previous)
+                os.rename(live, previous)
+
+            # Renaming the new link over the old one is atomic.
+            tmp_link = '{0}.{1}.tmp'.format(live, os.getpid())
+            media.remove(tmp_link)
+            os.symlink(os.path.relpath(staging, os.path.dirname(live)),
+                    tmp_link)
+            os.rename(tmp_link, live)
+
+            keep = set(os.path.normpath(p) for p in (staging, previous) if p)
+            for name in os.listdir(builds):
+                path = os.path.join(builds, name)
+                if os.path.normpath(path) not in keep:
+                    media.remove(path)
+
+        logging.info('Swapped the staged output into {0}'.format(live))
+
     def load_pages(self):
         """Load all the content files."""
+        # Pick up templates that changed since the last build, when the dev
+        # server rebuilds the site.
+        if Page.tmpl_env is not None:
+            Page.tmpl_env.loader.refresh()
+
         # Load pages from hooks (pre)
         for pages in self.run_hook('site.content.gather.pre'):
             if pages:
                 self.all_pages.extend(pages)
 
-        # Load files
+        # Scan the files for their metadata first, and render their markup
+        # once all of them are known.
+        loaded = self.scan_pages()
+        self.check_collisions(self.all_pages + loaded)
+        self.markup_pages(loaded)
+        self.all_pages.extend(loaded)
+
+        # Load pages from hooks (post)
+        for pages in self.run_hook('site.content.gather.post', self.all_pages):
+            if pages:
+                self.all_pages.extend(pages)
+
+    def scan_pages(self):
+        """
+        Load the metadata of every content file, without rendering any
+        markup. Returns the published pages.
+        """
+        loaded = []
         for root, dirs, files in os.walk(self.options['content_dir']):
             # Filter out files if they match any of the ignore patterns
             for ig in self.options['ignore_files']:
@@ -373,14 +722,107 @@ class Engine(object):
                             'for {0}. Using default renderer.'.format(f))
                     renderer = renderers.Renderer
 
-                p = Page.from_file(os.path.join(root, f), self.options, self, renderer)
+                p = Page.from_file(os.path.join(root, f), self.options, self,
+                        renderer, markup=False)
                 if p and p.meta['published']:
-                    self.all_pages.append(p)
+                    loaded.append(p)
+        return loaded
 
-        # Load pages from hooks (post)
-        for pages in self.run_hook('site.content.gather.post', self.all_pages):
-            if pages:
-                self.all_pages.extend(pages)
+    def check_collisions(self, pages):
+        """
+        Warn about pages that share a slug, of which only one can be in
+        `site.slugs`, and log an error for pages that would be written to the
+        same file.
+        """
+        slugs = {}
+        paths = {}
+        for p in pages:
+            name = p.path or p.meta['slug']
+            other = slugs.setdefault(p.meta['slug'], name)
+            if other != name:
+                logging.warning('{0} and {1} have the same slug "{2}".'.format(
+                    other, name, p.meta['slug']))
+
+            if not p.meta['make_file']:
+                continue
+            output = p.output_path()
+            other = paths.setdefault(output, name)
+            if other != name:
+                logging.error('{0} and {1} would both be written to {2}. '
+                        'Only one of them will be.'.format(other, name,
+                            output))
+
+    def markup_pages(self, pages):
+        """
+        Render the markup of the pages loaded from the content directory, or
+        set them up to render it when it is used.
+        """
+        if self.options['incremental']:
+            self.render_changed_markup(pages)
+        elif self.options['lazy_markup'] or self.options['low_memory']:
+            for p in pages:
+                p.lazy_markup()
+        else:
+            self.render_markup(pages)
+
+    def render_markup(self, pages):
+        """
+        Render the markup of `pages`. With more than one job, the rendering is
+        spread over a pool of processes, and the `page.render.pre` hooks of
+        all the pages run before the `page.render.post` hooks of any of them.
+        """
+        jobs = self.options['jobs']
+        if jobs <= 1 or len(pages) <= 1 or not hasattr(os, 'fork'):
+            for p in pages:
+                p.render_markup()
+            return
+
+        logging.info('Rendering markup with {0} processes.'.format(jobs))
+        for p in pages:
+            self.run_hook('page.render.pre', p)
+
+        markups = util.fork_map(lambda p: p.markup(), pages, jobs)
+
+        for p, (content, preview) in zip(pages, markups):
+            p.meta['content'] = content
+            p.meta['preview'] = preview
+            self.run_hook('page.render.post', p)
+
+    def render_changed_markup(self, pages):
+        """
+        Render the markup of the pages that changed since the last build, and
+        take the rest from the manifest.
+        """
+        site_digest = digest(*sorted('{0}:{1}'.format(p.path, p.header_digest)
+                                     for p in pages))
+        self.source_digests = dict((p.path, p.source_digest) for p in pages)
+
+        changed = []
+        for p in pages:
+            p.build_key = digest(self.env_digest, site_digest, p.source_digest,
+                    getattr(p.renderer, '__module__', ''),
+                    getattr(p.renderer, '__name__', ''))
+
+            entry = None
+            if ('list' not in p.meta['pagination']
+                    and p.meta.get('incremental', True)):
+                entry = self.manifest.lookup(p.path, p.build_key)
+
+            if entry is None:
+                changed.append(p)
+                continue
+
+            # The markup is still good, but the page has to be written again
+            # if the markup of a page it shows changed.
+            p.meta['content'] = entry['content']
+            p.meta['preview'] = entry['preview']
+            if all(self.source_digests.get(path) == source_digest
+                   for path, source_digest in entry['deps'].iteritems()):
+                self.fresh_pages[p.path] = entry
+
+        logging.info('{0} of {1} pages are unchanged.'.format(
+            len(self.fresh_pages), len(pages)))
+        self.render_markup(changed)
 
     def make_tree(self):
         """
@@ -392,81 +834,331 @@ class Engine(object):
         """
         self.categories = {}
         site_tree = []
+        # Every page in the tree, by its category path and slug.
+        nodes = {}
         # We want to parse these in a approximately breadth first order
         self.all_pages.sort(key=lambda p: len(p.meta['category']))
 
         # For every page
         for p in self.all_pages:
+            category = tuple(p.meta['category'])
             # If it has a category (ie: is not at top level)
-            if len(p.meta['category']) > 0:
-                top_cat = p.meta['category'][0]
+            if category:
+                top_cat = category[0]
                 if not top_cat in self.categories:
                     self.categories[top_cat] = []
 
                 self.categories[top_cat].append(p.meta)
 
-            try:
                 # Put this page's meta in the right place in site_tree.
+                parent = nodes.get(category)
+                if parent is None:
+                    logging.error('It looks like the page "{0}" is an orphan! '
+                            'This will probably cause problems.'.format(p.path))
+                    continue
+                siblings = parent['subpages']
+            else:
                 siblings = site_tree
-                for cat in p.meta['category']:
-                    # This line will fail if the page is an orphan
-                    parent = [subpage for subpage in siblings
-                                 if subpage['slug'] == cat][0]
-                    siblings = parent['subpages']
-                siblings.append(p.meta)
-            except IndexError:
-                logging.error('It looks like the page "{0}" is an orphan! '
-                        'This will probably cause problems.'.format(p.path))
+
+            siblings.append(p.meta)
+            # The first page with a slug is the one sub pages go under.
+            nodes.setdefault(category + (p.meta['slug'],), p.meta)
+
+        self.category_index = self.index_categories(site_tree)
+
+    def index_categories(self, site_tree):
+        """
+        Index the category tree by path. Each node has the `path` of the
+        page in the tree, the `page` itself, its `children` nodes sorted by
+        slug, and the `count` of pages below it. The root of the tree has the
+        path `''` and no page.
+        """
+        index = {}
+
+        def add(meta, parent_path):
+            path = parent_path + [meta['slug']]
+            children = [add(sub, path) for sub in meta['subpages']]
+            node = self.category_node('/'.join(path), meta, children)
+            index.setdefault(node['path'], node)
+            return node
+
+        index[''] = self.category_node('', None,
+                [add(meta, []) for meta in site_tree])
+        return index
+
+    def category_node(self, path, meta, children):
+        children.sort(key=lambda n: n['page']['slug'])
+        return {
+            'path': path,
+            'page': meta,
+            'children': children,
+            'count': sum(1 + child['count'] for child in children),
+        }
 
     def render_site(self):
         """Render every page and write the output files."""
-        # Gather tags
-        tag_set = set()
+        self.site_context = self.make_site_context()
+
+        self.output_count = 0
+        self.modified_count = 0
+
+        self.markup_reads = set()
+        if self.options['incremental']:
+            self.track_markup_reads()
+
+        try:
+            if self.options['jobs'] > 1 and hasattr(os, 'fork'):
+                self.render_pages_parallel()
+            else:
+                if self.options['low_memory']:
+                    self.spool = self.make_spool()
+                self.render_pages()
+        finally:
+            if Page.tmpl_env is not None:
+                Page.tmpl_env.read_markup = None
+
+        logging.info('Wrote {0} of {1} output files, the others were '
+                'unchanged.'.format(self.modified_count, self.output_count))
+
+    def track_markup_reads(self):
+        """
+        Collect the source paths of the pages whose `content` or `preview`
+        the templates read in `markup_reads`, so that `record_page` can
+        store them as dependencies of the page being rendered.
+        """
+        meta_paths = dict((id(p.meta), p.path) for p in self.all_pages
+                          if p.path is not None)
+
+        def read_markup(obj):
+            path = meta_paths.get(id(obj))
+            if path is not None:
+                self.markup_reads.add(path)
+
+        if Page.tmpl_env is None:
+            Page.create_tmpl_env(self.options)
+        Page.tmpl_env.read_markup = read_markup
+
+    def index_tags(self):
+        """
+        Gather the pages of every tag in one pass over the pages. Returns the
+        pages of each tag in site order, the number of pages of each tag, and
+        the pages of each tag sorted newest first, with undated pages last.
+        """
+        tag_dict = {}
         for p in self.all_pages:
-            tag_set = tag_set.union(p.meta['tags'])
-        tag_dict = dict()
-        for tag in tag_set:
-            # Add all pages with the current tag to the tag dict
-            tag_dict[tag] = [p.meta for p in self.all_pages
-                                if tag in p.meta['tags']]
+            for tag in set(p.meta['tags']):
+                tag_dict.setdefault(tag, []).append(p.meta)
 
-        # Gather slugs
-        slug_dict = dict((p.meta['slug'], p.meta) for p in self.all_pages)
+        def newest_first(meta):
+            return (meta['datetime'] is not None,
+                    meta['datetime'] or datetime.min)
 
+        tag_counts = {}
+        tags_by_date = {}
+        for tag, pages in tag_dict.iteritems():
+            tag_counts[tag] = len(pages)
+            tags_by_date[tag] = sorted(pages, key=newest_first, reverse=True)
+
+        return tag_dict, tag_counts, tags_by_date
+
+    def render_pages(self):
+        """Render and write the pages one at a time."""
         for p in self.all_pages:
-            # Construct this every time, to avoid sharing one instance
-            # between page objects.
-            templ_vars = {
-                'site': {
-                    'title': self.options.get('site_title', 'Untitled'),
-                    'datetime': datetime.now(),
-                    'date': datetime.now().date(),
-                    'time': datetime.now().time(),
-                    'tags': tag_dict,
-                    'pages': self.all_pages[:],
-                    'categories': self.categories,
-                    'slugs': slug_dict,
-                },
-            }
-
-            for k, v in self.options.iteritems():
-                if k not in ('site_title', 'output_dir', 'content_dir',
-                        'templates_dir', 'media_dir', 'url_pattern'):
-
-                    templ_vars['site'][k] = v
-
-            if 'author' in self.options:
-                templ_vars['site']['author'] = self.options['author']
+            if p.path in self.fresh_pages:
+                self.record_page(p, None)
+                continue
+
+            templ_vars = self.template_vars()
 
             # Rendering the page might give us back more pages to render.
+            self.markup_reads.clear()
             new_pages = p.render(templ_vars)
-
-            if p.meta['make_file']:
-                p.write()
+            self.record_page(p, self.write_page(p), self.markup_reads)
+            if self.spool is not None:
+                p.release(self.spool)
 
             if new_pages:
                 logging.debug('found new_pages')
                 self.all_pages += new_pages
+                self.site_context['pages'] = tuple(self.all_pages)
+
+    def make_spool(self):
+        """
+        Make the file that the text of written pages is moved to, with
+        `low_memory`. See `Page.release`.
+        """
+        cache_dir = self.options['cache_dir']
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        return util.Spool(os.path.join(cache_dir,
+            'spool.{0}'.format(os.getpid())))
+
+    def render_pages_parallel(self):
+        """
+        Render and write the pages in a pool of processes.
+
+        Pagination is done up front, so that the extra pages it makes are
+        rendered in the same pool. Every page sees the same `site.pages` it
+        would have seen in a serial build. Hooks run in the worker processes,
+        so changes they make to anything but the page being written are lost.
+        """
+        site_sizes = []
+        idx = 0
+        while idx < len(self.all_pages):
+            p = self.all_pages[idx]
+            site_sizes.append(len(self.all_pages))
+            if (p.path not in self.fresh_pages
+                    and 'list' in p.meta['pagination']):
+                new_pages = p.paginate(self.template_vars())
+                if new_pages:
+                    self.all_pages += new_pages
+                    self.site_context['pages'] = tuple(self.all_pages)
+            idx += 1
+
+        # Pages before the same pagination page see the same list, so only
+        # slice it once for each size.
+        site_pages = {}
+
+        def render(idx):
+            p = self.all_pages[idx]
+            if p.path in self.fresh_pages:
+                return None
+            size = site_sizes[idx]
+            if size not in site_pages:
+                site_pages[size] = tuple(self.all_pages[:size])
+            self.markup_reads.clear()
+            p.render(self.template_vars(site_pages[size]))
+            return self.write_page(p), sorted(self.markup_reads)
+
+        logging.info('Rendering {0} pages with {1} processes.'.format(
+            len(self.all_pages), self.options['jobs']))
+        results = util.fork_map(render, range(len(self.all_pages)),
+                self.options['jobs'])
+
+        for p, result in zip(self.all_pages, results):
+            if result is None:
+                self.record_page(p, None)
+            else:
+                self.record_page(p, *result)
+
+    def make_site_context(self):
+        """
+        Make the `site` template variable. It is made once per build and
+        shared by every page, so `site.datetime` is the same on every page.
+        `site.pages` is a tuple of the pages being rendered, so templates and
+        hooks can't change the list the engine works through. It is made again
+        when pagination adds pages.
+        """
+        tag_dict, tag_counts, tags_by_date = self.index_tags()
+
+        # Gather slugs
+        slug_dict = dict((p.meta['slug'], p.meta) for p in self.all_pages)
+
+        now = datetime.now()
+        site = {
+            'title': self.options.get('site_title', 'Untitled'),
+            'datetime': now,
+            'date': now.date(),
+            'time': now.time(),
+            'tags': tag_dict,
+            'tag_counts': tag_counts,
+            'tags_by_date': tags_by_date,
+            'pages': tuple(self.all_pages),
+            'categories': self.categories,
+            'category_index': self.category_index,
+            'slugs': slug_dict,
+        }
+
+        for k, v in self.options.iteritems():
+            if k not in ('site_title', 'output_dir', 'content_dir',
+                    'templates_dir', 'media_dir', 'url_pattern'):
+
+                site[k] = v
+
+        if 'author' in self.options:
+            site['author'] = self.options['author']
+
+        return site
+
+    def template_vars(self, pages=None):
+        """
+        Make the template variables for rendering a page. The `site` dict is
+        a shallow copy of the shared one, so hooks can change it for one page
+        without affecting the others. `pages` replaces `site.pages`.
+        """
+        site = dict(self.site_context)
+        if pages is not None:
+            site['pages'] = pages
+        return {'site': site}
+
+    def write_page(self, p):
+        """
+        Write a rendered page. Returns the list of its output files, and the
+        number of them that actually changed.
+        """
+        if not p.meta['make_file']:
+            return [], 0
+        modified = p.write()
+        return [p.output_path()], int(modified)
+
+    def record_page(self, p, result, reads=()):
+        """
+        Count the output files of a page, and record them in the manifest.
+        `result` is what `write_page` returned, or None for pages that were
+        not rebuilt, which keep the outputs of the previous build. `reads`
+        are the paths of the pages whose markup the page showed.
+        """
+        outputs, modified = result or ([], 0)
+        self.output_count += len(outputs)
+        self.modified_count += modified
+
+        if self.manifest is None:
+            return
+
+        entry = self.fresh_pages.get(p.path)
+        if entry is not None:
+            self.manifest.record(p.path, p.build_key, entry['outputs'],
+                    entry['content'], entry['preview'], entry['deps'])
+        elif self.options['incremental']:
+            deps = dict((path, self.source_digests.get(path))
+                        for path in reads if path != p.path)
+            self.manifest.record(p.path, getattr(p, 'build_key', None),
+                    outputs, unicode(p.meta.get('content', '')),
+                    unicode(p.meta.get('preview', '')), deps)
+        else:
+            self.manifest.record(p.path, outputs=outputs)
+
+    def prune_caches(self):
+        """Shrink the caches that have grown past their size limit."""
+        if renderers.cache is not None:
+            renderers.cache.prune()
+
+    def save_manifest(self):
+        """
+        Remove the outputs of the previous build that this build didn't
+        produce, and save the manifest for the next build.
+        """
+        if self.manifest is None:
+            return
+
+        output_dir = os.path.normpath(self.options['output_dir'])
+        for path in self.manifest.stale_outputs():
+            logging.info('Removing stale output {0}'.format(path))
+            try:
+                os.unlink(path)
+            except OSError:
+                continue
+
+            # Clean up directories that are now empty.
+            parent = os.path.dirname(os.path.normpath(path))
+            while parent != output_dir and parent.startswith(output_dir):
+                try:
+                    os.rmdir(parent)
+                except OSError:
+                    break
+                parent = os.path.dirname(parent)
+
+        self.manifest.save()
 
 if __name__ == '__main__':
     Engine()
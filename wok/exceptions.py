@@ -1,2 +1,15 @@
 class DependencyException(Exception):
     pass
+
+class WorkerError(Exception):
+    """
+    An exception raised in a worker process of `wok.util.fork_map`. The
+    exception itself can't always be sent back to the main process, so this
+    carries its type name and traceback instead.
+    """
+
+    def __init__(self, type_name, traceback):
+        Exception.__init__(self, '{0} in a worker process:\n{1}'.format(
+            type_name, traceback))
+        self.type_name = type_name
+        self.traceback = traceback
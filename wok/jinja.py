@@ -1,13 +1,27 @@
-import glob
 import os
+import sys
+import json
+import logging
 import fnmatch
+import zipfile
 
-from jinja2.loaders import FileSystemLoader, TemplateNotFound
+from jinja2 import Environment
+from jinja2.loaders import FileSystemLoader, ModuleLoader, TemplateNotFound
 from jinja2.loaders import split_template_path
 
 class AmbiguousTemplate(Exception):
     pass
 
+def match_names(names, pattern):
+    """
+    Return the file names in `names` that match the glob `pattern`. Like
+    glob, wildcards don't match hidden files.
+    """
+    matches = fnmatch.filter(names, pattern)
+    if not pattern.startswith('.'):
+        matches = [n for n in matches if not n.startswith('.')]
+    return matches
+
 class GlobFileLoader(FileSystemLoader):
     """
     As ``jinja2.loaders.FileSystemLoader`` except allow support for globbing.
@@ -21,38 +35,186 @@ class GlobFileLoader(FileSystemLoader):
 
     Per default the template encoding is ``'utf-8'`` which can be changed
     by setting the `encoding` parameter to something else.
+
+    Templates are looked up in an index of the template directories, which
+    is made once and only made again by `refresh` if a file in them was
+    added, removed or changed.
     """
 
     def __init__(self, ignores=[], *args, **kwargs):
         super(GlobFileLoader, self).__init__(*args, **kwargs)
         self.ignores = ignores
+        self.files = None
+        self.mtimes = None
+        self.resolved = {}
+        self.generation = 0
 
-    def get_source(self, environment, template):
+    def scan(self):
+        """
+        Return the names of the files in every template directory, and the
+        modification time of every file.
+        """
+        files = {}
+        mtimes = {}
+        for searchpath in self.searchpath:
+            for root, dirs, names in os.walk(searchpath):
+                # Filter out files if they match any of the ignore patterns
+                for ig in self.ignores:
+                    names = [n for n in names if not fnmatch.fnmatch(n, ig)]
+                files[os.path.normpath(root)] = names
+                for name in names:
+                    path = os.path.join(root, name)
+                    try:
+                        mtimes[path] = os.path.getmtime(path)
+                    except OSError:
+                        pass
+        return files, mtimes
+
+    def refresh(self):
+        """
+        Index the template directories again, if anything in them changed.
+        Templates loaded before such a change are then out of date.
+        """
+        files, mtimes = self.scan()
+        if files == self.files and mtimes == self.mtimes:
+            return
+        self.files = files
+        self.mtimes = mtimes
+        self.resolved = {}
+        self.generation += 1
+
+    def resolve(self, template):
+        """
+        Return the file name of `template`, which may have glob patterns in
+        its file name, or None if there is no such template. Raises
+        `AmbiguousTemplate` if more than one file matches.
+        """
+        if self.files is None:
+            self.refresh()
+        if template not in self.resolved:
+            self.resolved[template] = self.match(template)
+        filename = self.resolved[template]
+        if filename is AmbiguousTemplate:
+            raise AmbiguousTemplate(template)
+        return filename
+
+    def match(self, template):
         pieces = split_template_path(template)
         for searchpath in self.searchpath:
-            globbed_filename = os.path.join(searchpath, *pieces)
-            filenames = glob.glob(globbed_filename)
-
-            # Filter out files if they match any of the ignore patterns
-            for ig in self.ignores:
-                filenames = [ f for f in filenames 
-                        if not fnmatch.fnmatch(os.path.basename(f), ig) ]
-
-            if len(filenames) > 1:
-                raise AmbiguousTemplate(template)
-            elif len(filenames) < 1:
-                continue
-            filename = filenames[0]
-
-            with open(filename) as f:
-                contents = f.read().decode(self.encoding)
-
-            mtime = os.path.getmtime(filename)
-            def uptodate():
-                try:
-                    return os.path.getmtime(filename) == mtime
-                except OSError:
-                    return False
-            return contents, filename, uptodate
-        else:
+            directory = os.path.normpath(os.path.join(searchpath, *pieces[:-1]))
+            names = match_names(self.files.get(directory, []), pieces[-1])
+            if len(names) > 1:
+                return AmbiguousTemplate
+            elif names:
+                return os.path.join(directory, names[0])
+        return None
+
+    def get_source(self, environment, template):
+        filename = self.resolve(template)
+        if filename is None:
             raise TemplateNotFound(template)
+
+        with open(filename) as f:
+            contents = f.read().decode(self.encoding)
+
+        generation = self.generation
+        def uptodate():
+            return self.generation == generation
+        return contents, filename, uptodate
+
+
+class TrackingEnvironment(Environment):
+    """
+    An environment that reports which pages' `content` and `preview` the
+    templates read, so incremental builds know what else a page depends on.
+    While `read_markup` is set, it is called with the object the markup is
+    read from.
+    """
+
+    markup_keys = ('content', 'preview')
+    read_markup = None
+
+    def getattr(self, obj, attribute):
+        if attribute in self.markup_keys and self.read_markup is not None:
+            self.read_markup(obj)
+        return Environment.getattr(self, obj, attribute)
+
+    def getitem(self, obj, argument):
+        if argument in self.markup_keys and self.read_markup is not None:
+            self.read_markup(obj)
+        return Environment.getitem(self, obj, argument)
+
+
+class CompiledLoader(ModuleLoader):
+    """
+    Loads templates precompiled by `compile_templates`, from a directory or
+    zip file. Templates are looked up with the same glob patterns as with
+    ``GlobFileLoader``, so sites can be built from the compiled templates
+    alone.
+    """
+
+    def __init__(self, path):
+        super(CompiledLoader, self).__init__(path)
+        try:
+            if zipfile.is_zipfile(path):
+                with zipfile.ZipFile(path) as z:
+                    names = json.loads(z.read('index.json'))
+            else:
+                with open(os.path.join(path, 'index.json')) as f:
+                    names = json.load(f)
+        except (IOError, KeyError):
+            logging.critical('There are no compiled templates in {0}. Run '
+                    '`wok --compile-templates` first. Aborting.'.format(path))
+            sys.exit(1)
+
+        # Template names by directory.
+        self.files = {}
+        for name in names:
+            directory, base = os.path.split(name)
+            self.files.setdefault(directory, []).append(base)
+
+    def refresh(self):
+        """Compiled templates don't change, so there is nothing to do."""
+
+    def load(self, environment, name, globals=None):
+        pieces = split_template_path(name)
+        directory = '/'.join(pieces[:-1])
+        names = match_names(self.files.get(directory, []), pieces[-1])
+        if len(names) > 1:
+            raise AmbiguousTemplate(name)
+        elif not names:
+            raise TemplateNotFound(name)
+
+        filename = '/'.join(pieces[:-1] + [names[0]])
+        template = super(CompiledLoader, self).load(environment, filename,
+                globals)
+        # The file name of the original template, whose extension the output
+        # file gets.
+        template.filename = filename
+        return template
+
+
+def compile_templates(environment, target, ignores=()):
+    """
+    Compile the templates of `environment` into `target`, which is a zip file
+    if it ends in `.zip`, and a directory otherwise. Files that match
+    `ignores`, and hidden files, are left out.
+    """
+    def wanted(name):
+        base = os.path.basename(name)
+        return not (base.startswith('.')
+                or any(fnmatch.fnmatch(base, ig) for ig in ignores))
+
+    names = environment.list_templates(filter_func=wanted)
+    use_zip = target.endswith('.zip')
+    environment.compile_templates(target, filter_func=wanted,
+            zip='deflated' if use_zip else None, ignore_errors=False)
+
+    index = json.dumps(names)
+    if use_zip:
+        with zipfile.ZipFile(target, 'a') as z:
+            z.writestr('index.json', index)
+    else:
+        with open(os.path.join(target, 'index.json'), 'w') as f:
+            f.write(index)
+    return names
@@ -0,0 +1,185 @@
+"""
+A persistent record of what the previous build produced.
+
+The manifest is stored as JSON in the site's cache directory. For every
+source file it remembers a key describing the inputs the page was built from,
+the output files it produced, the rendered markup, and the pages whose
+markup it shows along with the digests of their sources, so that later builds
+can skip pages whose inputs have not changed and remove the outputs of
+sources that have gone away. It also remembers which media files were
+deployed, so that media removed from the source can be removed as well.
+"""
+import os
+import json
+import hashlib
+import logging
+
+
+def digest(*parts):
+    """Return a hex digest of the given strings."""
+    h = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, unicode):
+            part = part.encode('utf-8')
+        h.update(part)
+        h.update('\0')
+    return h.hexdigest()
+
+def digest_tree(*dirs):
+    """
+    Return a hex digest of the names and contents of every file under the
+    given directories. Files are hashed like the files in a directory, and
+    paths that don't exist are skipped.
+    """
+    h = hashlib.sha1()
+    for d in dirs:
+        if os.path.isfile(d):
+            h.update(d)
+            h.update('\0')
+            with open(d, 'rb') as fp:
+                h.update(fp.read())
+            continue
+        if not os.path.isdir(d):
+            continue
+        for root, dirnames, filenames in os.walk(d):
+            dirnames.sort()
+            for f in sorted(filenames):
+                path = os.path.join(root, f)
+                h.update(path)
+                h.update('\0')
+                with open(path, 'rb') as fp:
+                    h.update(fp.read())
+    return h.hexdigest()
+
+
+class BuildManifest(object):
+    """
+    The build manifest for a site.
+
+    `pages` holds the entries from the previous build, keyed by source path,
+    and `media` the media files it deployed. Entries for the current build are
+    collected with `record` and `record_media`, and replace the old ones when
+    the manifest is saved.
+
+    Output paths are stored relative to `root`, the directory the site is
+    written to, so they stay valid when that directory is moved.
+    """
+
+    version = 3
+
+    def __init__(self, path, root='.'):
+        self.path = path
+        self.root = root
+        self.pages = {}
+        self.media = []
+        self.new_pages = {}
+        self.new_media = []
+        self.outputs = set()
+
+    @classmethod
+    def load(cls, path, root='.'):
+        """
+        Load the manifest at `path`. A missing or unreadable manifest gives
+        an empty one, which makes every page look out of date.
+        """
+        manifest = cls(path, root)
+        if not os.path.isfile(path):
+            return manifest
+
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (IOError, ValueError) as e:
+            logging.warning('Could not read the build manifest {0}: {1}. '
+                            'Doing a full build.'.format(path, e))
+            return manifest
+
+        if data.get('version') != cls.version:
+            logging.info('Build manifest is from another version of wok. '
+                         'Doing a full build.')
+            return manifest
+
+        manifest.pages = data.get('pages', {})
+        manifest.media = data.get('media', [])
+        return manifest
+
+    def __nonzero__(self):
+        return bool(self.pages or self.media)
+
+    def lookup(self, source, key):
+        """
+        Return the previous entry for `source` if it was built from the same
+        `key` and all of its outputs still exist, otherwise None.
+        """
+        entry = self.pages.get(source)
+        if entry is None or entry['key'] != key:
+            return None
+        outputs = [os.path.join(self.root, out) for out in entry['outputs']]
+        if not all(os.path.isfile(out) for out in outputs):
+            return None
+        return dict(entry, outputs=outputs)
+
+    def relative(self, paths):
+        return [os.path.relpath(path, self.root) for path in paths]
+
+    def record(self, source, key=None, outputs=(), content=None,
+            preview=None, deps=None):
+        """
+        Record what `source` was built from and produced in this build.
+        `deps` maps the sources of the other pages whose markup it shows to
+        the digests of those sources. Outputs of pages that don't come from a
+        file are recorded with a `source` of None, so they are never
+        considered stale.
+        """
+        outputs = self.relative(outputs)
+        self.outputs.update(outputs)
+        if source is None:
+            return
+
+        entry = self.new_pages.setdefault(source, {
+            'key': key,
+            'outputs': [],
+            'content': content,
+            'preview': preview,
+            'deps': {},
+        })
+        entry['outputs'].extend(outputs)
+        entry['deps'].update(deps or {})
+
+    def record_media(self, paths):
+        """Record the media files deployed in this build."""
+        paths = self.relative(paths)
+        self.new_media.extend(paths)
+        self.outputs.update(paths)
+
+    def stale_outputs(self):
+        """
+        Return the outputs and media files of the previous build that were not
+        produced by this one.
+        """
+        stale = set(self.media)
+        for entry in self.pages.itervalues():
+            stale.update(entry['outputs'])
+        return [os.path.join(self.root, out)
+                for out in sorted(stale - self.outputs)]
+
+    def save(self):
+        """Write the entries recorded during this build to disk."""
+        cache_dir = os.path.dirname(self.path)
+        if cache_dir and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({
+                'version': self.version,
+                'pages': self.new_pages,
+                'media': self.new_media,
+            }, f)
+        os.rename(tmp_path, self.path)
+
+        self.pages = self.new_pages
+        self.media = self.new_media
+        self.new_pages = {}
+        self.new_media = []
+        self.outputs = set()
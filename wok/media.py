@@ -0,0 +1,144 @@
+"""
+Deploying the media directory into the output directory.
+
+Media files can be deployed as copies, or as hard links, reflinks (copy on
+write clones) or symlinks to the files in the media directory. When a file
+can't be linked, it is copied instead.
+"""
+import os
+import shutil
+import hashlib
+import logging
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# The Linux ioctl that clones a file's extents into another file.
+FICLONE = 0x40049409
+
+modes = ('copy', 'hardlink', 'reflink', 'symlink')
+
+
+def file_digest(path):
+    """Return a hex digest of the contents of the file at `path`."""
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), ''):
+            h.update(block)
+    return h.hexdigest()
+
+def up_to_date(src, dst, checksum=False, mode='copy'):
+    """
+    Whether `dst` is already a copy of, or link to, `src`. Copies are compared
+    by size and modification time, or by size and contents if `checksum` is
+    true.
+    """
+    if os.path.islink(src):
+        return os.path.islink(dst) and os.readlink(src) == os.readlink(dst)
+    if mode == 'symlink':
+        return (os.path.islink(dst)
+                and os.readlink(dst) == os.path.abspath(src))
+    if os.path.islink(dst):
+        return False
+    if mode == 'hardlink' and os.path.exists(dst) and os.path.samefile(src, dst):
+        return True
+
+    try:
+        src_st = os.stat(src)
+        dst_st = os.stat(dst)
+    except OSError:
+        return False
+
+    if src_st.st_size != dst_st.st_size:
+        return False
+    if checksum:
+        return file_digest(src) == file_digest(dst)
+    return int(src_st.st_mtime) == int(dst_st.st_mtime)
+
+def remove(path):
+    """Remove the file, symlink or directory at `path`, if there is one."""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+def reflink(src, dst):
+    """
+    Make `dst` a copy on write clone of `src`. Raises an `IOError` or
+    `OSError` if the file system or platform can't do that.
+    """
+    if fcntl is None:
+        raise OSError('reflinks are not supported on this platform')
+    with open(src, 'rb') as src_f:
+        with open(dst, 'wb') as dst_f:
+            try:
+                fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+            except:
+                os.unlink(dst)
+                raise
+    shutil.copystat(src, dst)
+
+def deploy_file(src, dst, mode='copy'):
+    """
+    Deploy the file or symlink `src` to `dst`, as a copy or a link depending
+    on `mode`. Falls back to copying if the file can't be linked.
+    """
+    # Replace the file instead of writing into it, in case something else
+    # still refers to the old one.
+    remove(dst)
+    if os.path.islink(src):
+        os.symlink(os.readlink(src), dst)
+        return
+
+    try:
+        if mode == 'hardlink':
+            os.link(src, dst)
+            return
+        elif mode == 'reflink':
+            reflink(src, dst)
+            return
+        elif mode == 'symlink':
+            os.symlink(os.path.abspath(src), dst)
+            return
+    except (IOError, OSError) as e:
+        logging.debug('Could not {0} {1}, copying it instead: {2}'
+                .format(mode, src, e))
+        remove(dst)
+
+    shutil.copy2(src, dst)
+
+def sync_tree(src, dst, checksum=False, mode='copy'):
+    """
+    Deploy every file in the directory `src` that is new or has changed into
+    the directory `dst`, as a copy or a link depending on `mode`. Files in
+    `dst` that aren't in `src` are left alone.
+
+    Returns the paths in `dst` of all the files of `src`, and the number of
+    files that had to be deployed.
+    """
+    deployed = []
+    updated = 0
+    for root, dirs, files in os.walk(src):
+        rel_root = os.path.relpath(root, src)
+        dst_root = os.path.normpath(os.path.join(dst, rel_root))
+
+        if os.path.lexists(dst_root) and not os.path.isdir(dst_root):
+            os.unlink(dst_root)
+        if not os.path.isdir(dst_root):
+            os.makedirs(dst_root)
+
+        # Symlinks to directories are deployed as links, like files.
+        names = files + [d for d in dirs
+                         if os.path.islink(os.path.join(root, d))]
+        for name in names:
+            src_path = os.path.join(root, name)
+            dst_path = os.path.join(dst_root, name)
+            deployed.append(dst_path)
+            if not up_to_date(src_path, dst_path, checksum, mode):
+                logging.debug('Deploying media file {0}'.format(src_path))
+                deploy_file(src_path, dst_path, mode)
+                updated += 1
+
+    return deployed, updated
@@ -4,18 +4,22 @@ import sys
 from collections import namedtuple
 from datetime import datetime, date, time
 import logging
-import copy
 
 # Libraries
 import jinja2
-import yaml
 import re
 from slugify import slugify
 
 # Wok
 from wok import util
 from wok import renderers
-from wok.jinja import GlobFileLoader, AmbiguousTemplate
+from wok.manifest import digest
+from wok.jinja import GlobFileLoader, CompiledLoader, AmbiguousTemplate
+from wok.jinja import TrackingEnvironment
+
+# Used to clean up the URL of every page.
+extra_slashes = re.compile(r'//+')
+index_html = re.compile(r'/index\.html$')
 
 class Page(object):
     """
@@ -24,36 +28,78 @@ class Page(object):
     """
 
     tmpl_env = None
+    # Extensions of template file names, see `template_ext`.
+    template_exts = {}
 
     @classmethod
     def create_tmpl_env(cls, options):
-        cls.tmpl_env = jinja2.Environment(
-                loader=GlobFileLoader(
-                        searchpath=options.get('template_dir', 'templates'),
-                        ignores=options.get('ignore_files', [])),
-                extensions=options.get('jinja2_extensions', []))
+        extensions = options.get('jinja2_extensions', [])
+        # Incremental builds need to know which pages' markup a page shows.
+        env_class = (TrackingEnvironment if options.get('incremental')
+                     else jinja2.Environment)
+        if options.get('compiled_templates'):
+            cls.tmpl_env = env_class(
+                    loader=CompiledLoader(options['compiled_templates']),
+                    extensions=extensions)
+            return
+
+        cls.tmpl_env = env_class(
+                loader=cls.template_loader(options),
+                extensions=extensions,
+                bytecode_cache=cls.bytecode_cache(options, extensions))
+
+    @classmethod
+    def template_loader(cls, options):
+        """Make the loader for the templates in the template directory."""
+        return GlobFileLoader(
+                searchpath=options.get('template_dir', 'templates'),
+                ignores=options.get('ignore_files', []))
+
+    @classmethod
+    def bytecode_cache(cls, options, extensions):
+        """
+        Make the cache of compiled templates, if `template_cache` is set.
+        Templates are looked up by the hash of their source. Templates
+        compiled by another version of Jinja or Python, or with other
+        extensions, go in another directory.
+        """
+        if not options.get('template_cache'):
+            return None
+        directory = os.path.join(options.get('cache_dir', '.wok-cache'),
+                'templates', digest(jinja2.__version__, sys.version,
+                    repr(extensions)))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        return jinja2.FileSystemBytecodeCache(directory)
 
     def __init__(self, options, engine):
         self.options = options
         self.filename = None
+        self.path = None
         self.meta = {}
         self.engine = engine
+        # Text moved out of memory by `release`, and where it went.
+        self.spool = None
+        self.spooled = {}
 
     @classmethod
-    def from_meta(cls, meta, options, engine, renderer=renderers.Plain):
+    def from_meta(cls, meta, options, engine, renderer=renderers.Plain,
+            path=None):
         """
-        Build a page object from a meta dictionary.
+        Build a page object from a meta dictionary. `path` is the source file
+        the page comes from, if any.
 
         Note that you still need to call `render` and `write` to do anything
         interesting.
         """
         page = cls(options, engine)
+        page.path = path
         page.meta = meta
         page.options = options
         page.renderer = renderer
 
         if 'pagination' in meta:
-            logging.debug('from_meta: current page %d' %
+            logging.debug('from_meta: current page %d',
                     meta['pagination']['cur_page'])
 
         # Make a template environment. Hopefully no one expects this to ever
@@ -65,10 +111,14 @@ class Page(object):
         return page
 
     @classmethod
-    def from_file(cls, path, options, engine, renderer=renderers.Plain):
+    def from_file(cls, path, options, engine, renderer=renderers.Plain,
+            markup=True):
         """
         Load a file from disk, and parse the metadata from it.
 
+        If `markup` is false, the content is not rendered, and
+        `render_markup` has to be called before the page is rendered.
+
         Note that you still need to call `render` and `write` to do anything
         interesting.
         """
@@ -77,7 +127,7 @@ class Page(object):
         page.options = options
         page.renderer = renderer
 
-        logging.info('Loading {0}'.format(os.path.basename(path)))
+        logging.info('Loading %s', os.path.basename(path))
 
         if cls.tmpl_env is None:
             cls.create_tmpl_env(page.options)
@@ -85,44 +135,122 @@ class Page(object):
         page.path = path
         page.filename = os.path.basename(path)
 
-        with open(path, 'rU') as f:
-            page.original = f.read().decode('utf-8')
-            splits = page.original.split('\n---\n')
-
-            if len(splits) > 3:
-                logging.warning('Found more --- delimited sections in {0} '
-                                'than expected. Squashing the extra together.'
-                                .format(page.path))
+        with engine.span('read', 'page', path):
+            with open(path, 'rU') as f:
+                raw = f.read()
+            page.source_digest = digest(raw)
+            text = raw.decode('utf-8')
+            # Find the sections without splitting the whole text into copies.
+            header, delimiter, body = text.partition('\n---\n')
+            preview = None
 
             # Handle the case where no metadata was provided.
-            if len(splits) == 1:
-                page.original = splits[0]
-                page.meta = {}
+            if not delimiter:
+                header = u''
+                page.original = text
                 page.original_preview = ''
 
-            elif len(splits) == 2:
-                header = splits[0]
-                page.meta = yaml.load(header)
-                page.original = splits[1]
-                page.original_preview = page.meta.get('preview', '')
+            else:
+                preview, delimiter, rest = body.partition('\n---\n')
+                if not delimiter:
+                    preview = None
+                    page.original = body
 
-            elif len(splits) >= 3:
-                header = splits[0]
+                else:
+                    if '\n---\n' in rest:
+                        logging.warning('Found more --- delimited sections '
+                                'in {0} than expected. Squashing the extra '
+                                'together.'.format(page.path))
+                    page.original = body.replace('\n---\n', '\n')
+                    page.original_preview = preview
+                    logging.debug('Got preview')
+
+            page.header_digest = digest(header)
+
+        with engine.span('yaml', 'page', path):
+            if not header:
+                page.meta = {}
+            elif preview is None:
+                page.meta = util.load_yaml(header)
+                page.original_preview = page.meta.get('preview', '')
+            else:
                 page.meta = {}
-                page.original = '\n'.join(splits[1:])
-                page.original_preview = splits[1]
-                page.meta.update(yaml.load(header))
-                logging.debug('Got preview')
+                page.meta.update(util.load_yaml(header))
 
-        page.build_meta()
+        with engine.span('meta', 'page', path):
+            page.build_meta()
 
-        page.engine.run_hook('page.render.pre', page)
-        page.meta['content'] = page.renderer.render(page.original, page.meta)  # the page.meta might contain renderer options...
-        page.meta['preview'] = page.renderer.render(page.original_preview, page.meta)
-        page.engine.run_hook('page.render.post', page)
+        if markup:
+            page.render_markup()
 
         return page
 
+    def profile_name(self):
+        """The name of the page in build profiles."""
+        return self.path or self.meta.get('slug')
+
+    def render_markup(self):
+        """Render the page's content and preview with its renderer."""
+        self.engine.run_hook('page.render.pre', self)
+        with self.engine.span('markup', 'page', self.profile_name()):
+            self.meta['content'], self.meta['preview'] = self.markup()
+        self.engine.run_hook('page.render.post', self)
+
+    def lazy_markup(self):
+        """
+        Render the content and preview when they are first looked up instead
+        of now, so pages that never use them never render them.
+        """
+        self.meta = PageMeta(self, self.meta)
+        # A preview in the header is replaced by the rendered preview.
+        for key in PageMeta.lazy_keys:
+            self.meta.pop(key, None)
+        self.render_hooks_run = False
+
+    def render_lazy(self, key):
+        """
+        Render the `content` or `preview` of a page with lazy markup. The
+        render hooks run around the first of them that is rendered.
+        """
+        first = not self.render_hooks_run
+        if first:
+            self.render_hooks_run = True
+            self.engine.run_hook('page.render.pre', self)
+
+        name = 'original' if key == 'content' else 'original_preview'
+        text = getattr(self, name)
+        if text is None and name in self.spooled:
+            text = self.spool.get(self.spooled.pop(name))
+        with self.engine.span('markup', 'page', self.profile_name()):
+            dict.__setitem__(self.meta, key,
+                    renderers.render(self.renderer, text, self.meta))
+
+        if first:
+            self.engine.run_hook('page.render.post', self)
+        return dict.__getitem__(self.meta, key)
+
+    def markup(self):
+        """
+        Return the rendered content and preview of the page, without running
+        any hooks or changing the page.
+        """
+        # the page.meta might contain renderer options...
+        content = renderers.render(self.renderer, self.original, self.meta)
+        preview = renderers.render(self.renderer, self.original_preview,
+                self.meta)
+        return content, preview
+
+    @classmethod
+    def template_ext(cls, template):
+        """The extension of the file name of `template`, without the dot."""
+        ext = cls.template_exts.get(template.filename)
+        if ext is None:
+            ext = os.path.splitext(template.filename)[1]
+            if ext:
+                ext = ext[1:] # remove leading dot
+            cls.template_exts[template.filename] = ext
+        return ext
+
     def build_meta(self):
         """
         Ensures the guarantees about metadata for documents are valid.
@@ -263,8 +391,7 @@ class Page(object):
         else:
             self.meta['tags'] = []
 
-        logging.debug('Tags for {0}: {1}'.
-                format(self.meta['slug'], self.meta['tags']))
+        logging.debug('Tags for %s: %s', self.meta['slug'], self.meta['tags'])
 
         # pagination
         if 'pagination' not in self.meta:
@@ -297,12 +424,10 @@ class Page(object):
             'datetime': self.meta['datetime'],
             'time': self.meta['time'],
         }
-        logging.debug('current page: ' + repr(parts['page']))
+        logging.debug('current page: %r', parts['page'])
 
         # Pull extensions from the template's real file name.
-        parts['ext'] = os.path.splitext(self.template.filename)[1]
-        if parts['ext']:
-            parts['ext'] = parts['ext'][1:] # remove leading dot
+        parts['ext'] = self.template_ext(self.template)
         # Deprecated
         parts['type'] = parts['ext']
         self.meta['ext'] = parts['ext']
@@ -319,15 +444,16 @@ class Page(object):
 
         self.meta['url'] = self.url_pattern.format(**parts)
 
-        logging.info('URL pattern is: {0}'.format(self.url_pattern))
-        logging.info('URL parts are: {0}'.format(parts))
+        logging.info('URL pattern is: %s', self.url_pattern)
+        logging.info('URL parts are: %s', parts)
 
         # Get rid of extra slashes
-        self.meta['url'] = re.sub(r'//+', '/', self.meta['url'])
+        if '//' in self.meta['url']:
+            self.meta['url'] = extra_slashes.sub('/', self.meta['url'])
 
         # If we have been asked to, rip out any plain "index.html"s
         if not self.options['url_include_index']:
-            self.meta['url'] = re.sub(r'/index\.html$', '/', self.meta['url'])
+            self.meta['url'] = index_html.sub('/', self.meta['url'])
 
         # To be used for writing page content
         self.meta['path'] = self.meta['url']
@@ -341,7 +467,7 @@ class Page(object):
         if not self.options['relative_urls'] and self.meta['url'][0] != '/':
             self.meta['url'] = '/' + self.meta['url']
 
-        logging.debug('url is: ' + self.meta['url'])
+        logging.debug('url is: %s', self.meta['url'])
 
         # subpages
         self.meta['subpages'] = []
@@ -352,7 +478,7 @@ class Page(object):
         """
         Renders the page with the template engine.
         """
-        logging.debug('Rendering ' + self.meta['slug'])
+        logging.debug('Rendering %s', self.meta['slug'])
         if not templ_vars:
             templ_vars = {}
 
@@ -377,18 +503,34 @@ class Page(object):
 
         # ... and actions! (and logging, and hooking)
         self.engine.run_hook('page.template.pre', self, templ_vars)
-        logging.debug('templ_vars.keys(): ' + repr(templ_vars.keys()))
-        self.rendered = self.template.render(templ_vars)
-        logging.debug('extra pages is: ' + repr(extra_pages))
+        logging.debug('templ_vars.keys(): %r', templ_vars.keys())
+        if self.streams():
+            # The template is rendered by `write`, a piece at a time.
+            self.rendered = None
+            self.templ_vars = templ_vars
+        else:
+            with self.engine.span('template', 'page', self.profile_name()):
+                self.rendered = self.template.render(templ_vars)
+        logging.debug('extra pages is: %r', extra_pages)
         self.engine.run_hook('page.template.post', self)
 
         return extra_pages
 
+    def streams(self):
+        """
+        Whether the page is written straight from the template to its file,
+        with `stream_output`. Pages aren't streamed when they don't make a
+        file, or when a `page.template.post` hook needs `page.rendered`.
+        """
+        return bool(self.options.get('stream_output')
+                and self.meta['make_file']
+                and not self.engine.has_hook('page.template.post'))
+
     def paginate(self, templ_vars):
         extra_pages = []
-        logging.debug('called pagination for {0}'.format(self.meta['slug']))
+        logging.debug('called pagination for %s', self.meta['slug'])
         if 'page_items' not in self.meta['pagination']:
-            logging.debug('doing pagination for {0}'.format(self.meta['slug']))
+            logging.debug('doing pagination for %s', self.meta['slug'])
             # This is the first page of a set of pages. Set up the rest. Other
             # wise don't do anything.
 
@@ -419,12 +561,14 @@ class Page(object):
             if isinstance(source[0], Page):
                 source = [p.meta for p in source]
 
+            # Sort a copy, the source list is shared with other pages.
             if sort_key is not None:
                 if isinstance(source[0], dict):
-                    source.sort(key=lambda x: x[sort_key],
+                    source = sorted(source, key=lambda x: x[sort_key],
                             reverse=sort_reverse)
                 else:
-                    source.sort(key=lambda x: x.__getattribute__(sort_key),
+                    source = sorted(source,
+                            key=lambda x: x.__getattribute__(sort_key),
                             reverse=sort_reverse)
 
             chunks = list(util.chunk(source, self.meta['pagination']['limit']))
@@ -433,7 +577,10 @@ class Page(object):
 
             # Make a page for each chunk
             for idx, chunk in enumerate(chunks[1:], 2):
-                new_meta = copy.deepcopy(self.meta)
+                # Only the keys that differ are replaced, the rest is shared
+                # with this page, so a page costs the size of its chunk.
+                # `build_meta` replaces the other values it derives.
+                new_meta = self.meta.copy()
                 new_meta.update({
                     'url': self.url_pattern,
                     'pagination': {
@@ -442,8 +589,9 @@ class Page(object):
                         'cur_page': idx,
                     }
                 })
+                # Pagination pages come from the same source as this one.
                 new_page = self.from_meta(new_meta, self.options, self.engine,
-                    renderer=self.renderer)
+                    renderer=self.renderer, path=self.path)
                 logging.debug('page {0} is {1}'.format(idx, new_page))
                 if new_page:
                     extra_pages.append(new_page)
@@ -473,9 +621,8 @@ class Page(object):
 
         return extra_pages
 
-    def write(self):
-        """Write the page to a rendered file on disk."""
-
+    def output_path(self):
+        """The path of the file `write` will write to."""
         # Use what we are passed, or the default given, or the current dir
         base_path = self.options.get('output_dir', '.')
         path = self.meta['path']
@@ -484,26 +631,127 @@ class Page(object):
         base_path = os.path.join(base_path, path)
         if base_path.endswith('/'):
             base_path += 'index.' + self.meta['ext']
+        return base_path
+
+    def write(self):
+        """
+        Write the page to a rendered file on disk. If the file already has the
+        same contents it is left alone, so its modification time doesn't
+        change. Returns whether the file was written.
+        """
+        with self.engine.span('write', 'page', self.profile_name()):
+            return self.write_file()
+
+    def write_file(self):
+        base_path = self.output_path()
 
         try:
             os.makedirs(os.path.dirname(base_path))
         except OSError as e:
-            logging.debug('makedirs failed for {0}'.format(
-                os.path.basename(base_path)))
+            logging.debug('makedirs failed for %s',
+                os.path.basename(base_path))
             # Probably that the dir already exists, so thats ok.
             # TODO: double check this. Permission errors are something to worry
             # about
-        logging.info('writing to {0}'.format(base_path))
 
-        logging.debug('Writing {0} to {1}'.format(self.meta['slug'], base_path))
-        f = open(base_path, 'w')
-        f.write(self.rendered.encode('utf-8'))
-        f.close()
+        # Write a new file and move it into place, so the file is never seen
+        # half written, and a hard link to the old one keeps the old contents.
+        tmp_path = '{0}.{1}.tmp'.format(base_path, os.getpid())
+        if self.rendered is None:
+            # Streamed pages can only be compared once they are written.
+            try:
+                with open(tmp_path, 'w') as f:
+                    for piece in self.template.generate(self.templ_vars):
+                        f.write(piece.encode('utf-8'))
+            except:
+                # Don't leave the half written file in the output.
+                os.unlink(tmp_path)
+                raise
+            self.templ_vars = None
+            unchanged = util.same_files(tmp_path, base_path)
+            if unchanged:
+                os.unlink(tmp_path)
+        else:
+            rendered = self.rendered.encode('utf-8')
+            unchanged = util.same_contents(base_path, rendered)
+            if not unchanged:
+                with open(tmp_path, 'w') as f:
+                    f.write(rendered)
+
+        if unchanged:
+            logging.info('%s is unchanged', base_path)
+            return False
+
+        logging.info('writing to %s', base_path)
+        logging.debug('Writing %s to %s', self.meta['slug'], base_path)
+        os.rename(tmp_path, base_path)
+        return True
+
+    def release(self, spool):
+        """
+        Let go of the page's text once it has been written, with
+        `low_memory`. The rendered page is dropped, and the source and
+        rendered markup are moved to `spool`, from which the markup is read
+        back whenever another page uses it. Only pages with lazy markup keep
+        their markup on disk.
+        """
+        self.rendered = None
+        if not isinstance(self.meta, PageMeta):
+            return
+        if self.meta._page is not self:
+            # A pagination page, whose markup is read from the first page.
+            for key in PageMeta.lazy_keys:
+                dict.pop(self.meta, key, None)
+            return
+
+        self.spool = spool
+        for key, name in (('content', 'original'),
+                ('preview', 'original_preview')):
+            if key in self.meta:
+                self.spooled[key] = spool.put(dict.pop(self.meta, key))
+            elif getattr(self, name, None) is not None:
+                # Not rendered yet, keep the source to render it from.
+                self.spooled[name] = spool.put(getattr(self, name))
+            setattr(self, name, None)
 
     def __repr__(self):
         return "&lt;wok.page.Page '{0}'&gt;".format(self.meta['slug'])
 
 
+class PageMeta(dict):
+    """
+    Page metadata that renders the page's content and preview the first time
+    they are looked up. See `Page.lazy_markup`. Once the page is released,
+    they are read from its spool instead. See `Page.release`.
+    """
+
+    lazy_keys = ('content', 'preview')
+
+    def __init__(self, page, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._page = page
+
+    def __missing__(self, key):
+        if key not in self.lazy_keys:
+            raise KeyError(key)
+        page = self._page
+        if page.meta is not self:
+            # A copy for a pagination page, which has the same markup.
+            value = page.meta[key]
+        elif key in page.spooled:
+            # Released, read it back without keeping it.
+            return page.spool.get(page.spooled[key])
+        else:
+            value = page.render_lazy(key)
+            if page.spool is not None:
+                page.spooled[key] = page.spool.put(dict.pop(self, key))
+                return value
+        self[key] = value
+        return value
+
+    def copy(self):
+        return PageMeta(self._page, self)
+
 class Author(object):
     """Smartly manages a author with name and email"""
     parse_author_regex = re.compile(r'^([^<>]*) *(<(.*@.*)>)?$')
@@ -0,0 +1,261 @@
+"""
+Timing the phases of a build, and the steps of building each page.
+
+The profile is saved as JSON, and as a trace in the Chrome trace event
+format, which can be opened in chrome://tracing or Perfetto.
+"""
+import os
+import json
+import time
+
+# CPU time of this process.
+cpu_time = getattr(time, 'process_time', time.clock)
+
+
+class NullSpan(object):
+    """A span that doesn't record anything, for when nothing is profiled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+null_span = NullSpan()
+
+
+class Span(object):
+    """
+    Records the wall and CPU time of a `with` block in a `Profiler`, and its
+    self time, which leaves out the time of the spans nested in it.
+    """
+
+    def __init__(self, profiler, name, category, page):
+        self.profiler = profiler
+        self.name = name
+        self.category = category
+        self.page = page
+
+    def __enter__(self):
+        self.start = time.time()
+        self.start_cpu = cpu_time()
+        self.child_wall = 0.0
+        self.child_cpu = 0.0
+        self.profiler.open_spans.append(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        wall = time.time() - self.start
+        cpu = cpu_time() - self.start_cpu
+        self.profiler.open_spans.pop()
+        if self.profiler.open_spans:
+            parent = self.profiler.open_spans[-1]
+            parent.child_wall += wall
+            parent.child_cpu += cpu
+
+        self.profiler.events.append({
+            'name': self.name,
+            'category': self.category,
+            'page': self.page,
+            'start': self.start - self.profiler.start,
+            'wall': wall,
+            'cpu': cpu,
+            'self_wall': wall - self.child_wall,
+            'self_cpu': cpu - self.child_cpu,
+        })
+        return False
+
+
+def callable_name(func):
+    """Return a readable name for a hook, which can be any callable."""
+    name = getattr(func, '__name__', None) or type(func).__name__
+    module = getattr(func, '__module__', None)
+    if module:
+        return '{0}.{1}'.format(module, name)
+    return name
+
+
+class HookStats(object):
+    """
+    Counts the calls, time and exceptions of every hook, per hook name and
+    per callable.
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def call(self, hook_name, hook, *args):
+        """Call `hook` with `args`, and record how it went."""
+        start = time.time()
+        error = True
+        try:
+            result = hook(*args)
+            error = False
+            return result
+        finally:
+            self.record(hook_name, callable_name(hook), time.time() - start,
+                    error)
+
+    def record(self, hook_name, name, wall, error=False):
+        hook = self.stats.setdefault(hook_name, {})
+        stats = hook.get(name)
+        if stats is None:
+            stats = hook[name] = {'calls': 0, 'total': 0.0, 'max': 0.0,
+                    'errors': 0}
+        stats['calls'] += 1
+        stats['total'] += wall
+        if wall > stats['max']:
+            stats['max'] = wall
+        if error:
+            stats['errors'] += 1
+
+    def totals(self):
+        """Return the stats of every hook name, summed over its callables."""
+        totals = {}
+        for hook_name, hooks in self.stats.iteritems():
+            totals[hook_name] = {
+                'calls': sum(s['calls'] for s in hooks.itervalues()),
+                'total': sum(s['total'] for s in hooks.itervalues()),
+                'max': max(s['max'] for s in hooks.itervalues()),
+                'errors': sum(s['errors'] for s in hooks.itervalues()),
+            }
+        return totals
+
+    def slowest(self, n=10):
+        """
+        Return `(hook_name, callable name, stats)` for the `n` callables that
+        took the most time in total.
+        """
+        rows = [(hook_name, name, stats)
+                for hook_name, hooks in self.stats.iteritems()
+                for name, stats in hooks.iteritems()]
+        return sorted(rows, key=lambda row: row[2]['total'], reverse=True)[:n]
+
+    def as_dict(self):
+        return {'hooks': self.totals(), 'callables': self.stats}
+
+
+class Profiler(object):
+    """
+    Collects the time taken by each phase of a build and by each step of
+    building a page. Steps that run in worker processes, with more than one
+    job, aren't recorded.
+    """
+
+    def __init__(self):
+        self.start = time.time()
+        self.events = []
+        self.open_spans = []
+        self.hooks = HookStats()
+
+    def span(self, name, category='phase', page=None):
+        """
+        Time a `with` block. `page` is the name of the page the block works
+        on, if any.
+        """
+        return Span(self, name, category, page)
+
+    def phases(self):
+        """Return the wall and CPU time of every phase, in build order."""
+        return [{'name': e['name'], 'wall': e['wall'], 'cpu': e['cpu']}
+                for e in self.events if e['category'] == 'phase']
+
+    def pages(self):
+        """
+        Return the total wall and CPU time of every page, and of each of its
+        steps. Steps are counted by their self time, so the hooks run in a
+        step, or the markup of another page rendered lazily in a template,
+        aren't counted twice.
+        """
+        pages = {}
+        for e in self.events:
+            if e['page'] is None:
+                continue
+            page = pages.setdefault(e['page'], {'wall': 0.0, 'cpu': 0.0,
+                'steps': {}})
+            step = page['steps'].setdefault(e['name'], {'wall': 0.0,
+                'cpu': 0.0})
+            for key in ('wall', 'cpu'):
+                page[key] += e['self_' + key]
+                step[key] += e['self_' + key]
+        return pages
+
+    def slowest_pages(self, n=10):
+        """Return the names and times of the `n` slowest pages."""
+        pages = self.pages()
+        return sorted(pages.iteritems(), key=lambda item: item[1]['wall'],
+                reverse=True)[:n]
+
+    def trace(self):
+        """Return the events as a Chrome trace."""
+        pid = os.getpid()
+        events = []
+        for e in self.events:
+            args = {'cpu_ms': round(e['cpu'] * 1000, 3)}
+            if e['page'] is not None:
+                args['page'] = e['page']
+            events.append({
+                'name': e['name'],
+                'cat': e['category'],
+                'ph': 'X',
+                'ts': int(e['start'] * 1e6),
+                'dur': int(e['wall'] * 1e6),
+                'pid': pid,
+                'tid': 1,
+                'args': args,
+            })
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, directory):
+        """
+        Write the profile to `profile.json`, the trace to `trace.json` and the
+        hook stats to `hooks.json` in `directory`. Returns their paths.
+        """
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        profile_path = os.path.join(directory, 'profile.json')
+        with open(profile_path, 'w') as f:
+            json.dump({'phases': self.phases(), 'pages': self.pages()}, f,
+                    indent=1, sort_keys=True)
+
+        trace_path = os.path.join(directory, 'trace.json')
+        with open(trace_path, 'w') as f:
+            json.dump(self.trace(), f)
+
+        hooks_path = os.path.join(directory, 'hooks.json')
+        with open(hooks_path, 'w') as f:
+            json.dump(self.hooks.as_dict(), f, indent=1, sort_keys=True)
+
+        return profile_path, trace_path, hooks_path
+
+    def report(self, n=10):
+        """
+        Return a plain text report of the phases, slowest pages and slowest
+        hooks.
+        """
+        lines = ['Phase                    wall (s)   cpu (s)']
+        for phase in self.phases():
+            lines.append('{0:<24} {1:>8.3f}  {2:>8.3f}'.format(phase['name'],
+                phase['wall'], phase['cpu']))
+
+        slowest = self.slowest_pages(n)
+        if slowest:
+            lines.append('')
+            lines.append('Slowest pages  wall (s)   cpu (s)  slowest step')
+            for name, page in slowest:
+                step = max(page['steps'].iteritems(),
+                        key=lambda item: item[1]['wall'])[0]
+                lines.append('{0:>23.3f}  {1:>8.3f}  {2:<12}  {3}'.format(
+                    page['wall'], page['cpu'], step, name))
+
+        slowest = self.hooks.slowest(n)
+        if slowest:
+            lines.append('')
+            lines.append('Slowest hooks  total (s)   max (s)  calls  errors'
+                    '  hook')
+            for hook_name, name, stats in slowest:
+                lines.append('{0:>24.3f}  {1:>8.3f}  {2:>5}  {3:>6}  {4} '
+                    '({5})'.format(stats['total'], stats['max'],
+                        stats['calls'], stats['errors'], name, hook_name))
+        return '\n'.join(lines)
@@ -1,3 +1,6 @@
+import os
+import re
+import hashlib
 import logging
 from wok import util
 
@@ -12,6 +15,103 @@ except ImportError:
 # List of available renderers
 all = []
 
+# The cache used by `render`, if any. See `RenderCache`.
+cache = None
+
+def render(renderer, plain, page_meta):
+    """
+    Render `plain` with `renderer`, taking the result from the render cache
+    if it has it.
+
+    Only renderers with a `cache_options` method are cached. It should
+    return a string describing every option that changes the output of the
+    renderer. Renderers can also have a `cacheable` method, which tells if
+    `plain` can be cached, e.g. because it doesn't include other files.
+    """
+    if (cache is None or not hasattr(renderer, 'cache_options')
+            or not getattr(renderer, 'cacheable', bool)(plain)):
+        return renderer.render(plain, page_meta)
+
+    h = hashlib.sha1()
+    for part in (getattr(renderer, '__module__', ''),
+            getattr(renderer, '__name__', ''),
+            renderer.cache_options(page_meta), plain):
+        h.update(part.encode('utf-8') if isinstance(part, unicode) else part)
+        h.update('\0')
+    key = h.hexdigest()
+
+    rendered = cache.get(key)
+    if rendered is None:
+        rendered = renderer.render(plain, page_meta)
+        if isinstance(rendered, basestring):
+            cache.set(key, rendered)
+    return rendered
+
+
+class RenderCache(object):
+    """
+    An on-disk cache of rendered markup, keyed by hex digests.
+
+    Entries are stored one per file. Reading an entry marks it as recently
+    used, and `prune` removes the least recently used entries once the cache
+    is bigger than `max_size` bytes. Other caches can be used by giving
+    `wok.renderers.cache` any object with the `get` and `set` methods.
+    """
+
+    def __init__(self, directory, max_size=None):
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key):
+        """Return the cached text for `key`, or None."""
+        path = self.path(key)
+        try:
+            with open(path, 'rb') as f:
+                text = f.read().decode('utf-8')
+            os.utime(path, None)
+        except (IOError, OSError):
+            return None
+        return text
+
+    def set(self, key, text):
+        """Store `text` under `key`."""
+        path = self.path(key)
+        tmp_path = '{0}.{1}.tmp'.format(path, os.getpid())
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with open(tmp_path, 'wb') as f:
+                f.write(text.encode('utf-8'))
+            os.rename(tmp_path, path)
+        except (IOError, OSError) as e:
+            logging.warning('Could not write to the render cache: {0}'
+                    .format(e))
+
+    def prune(self):
+        """Remove least recently used entries until the cache fits."""
+        if self.max_size is None or not os.path.isdir(self.directory):
+            return
+
+        entries = []
+        total = 0
+        for root, dirs, files in os.walk(self.directory):
+            for f in files:
+                st = os.stat(os.path.join(root, f))
+                entries.append((st.st_mtime, st.st_size, os.path.join(root, f)))
+                total += st.st_size
+
+        entries.sort()
+        for mtime, size, path in entries:
+            if total <= self.max_size:
+                break
+            os.unlink(path)
+            total -= size
+        logging.debug('Render cache is {0} bytes.'.format(total))
+
+
 class Renderer(object):
     extensions = []
 
@@ -27,11 +127,15 @@ class Plain(Renderer):
     @classmethod
     def render(cls, plain, page_meta):
         return plain.replace('\n', '<br>')
+
+    @classmethod
+    def cache_options(cls, page_meta):
+        return ''
 all.append(Plain)
 
 # Include markdown, if it is available.
 try:
-    from markdown import markdown
+    from markdown import markdown, version as markdown_version
 
     class Markdown(Renderer):
         """Markdown renderer."""
@@ -51,6 +155,10 @@ try:
         def render(cls, plain, page_meta):
             return markdown(plain, extensions=cls.plugins)
 
+        @classmethod
+        def cache_options(cls, page_meta):
+            return repr((markdown_version, cls.plugins))
+
     all.append(Markdown)
 
 except ImportError:
@@ -73,6 +181,10 @@ if markdown is None:
             def render(cls, plain, page_meta):
                 return markdown2.markdown(plain, extras=cls.extras)
 
+            @classmethod
+            def cache_options(cls, page_meta):
+                return repr((markdown2.__version__, cls.extras))
+
         all.append(Markdown2)
     except ImportError:
         logging.warn('Markdown not enabled.')
@@ -88,6 +200,11 @@ try:
         from wok.rst_pygments import Pygments as RST_Pygments
         directives.register_directive('Pygments', RST_Pygments)
 
+    # Directives that read other files: include, and raw or csv-table with
+    # a file or url option.
+    rst_file_directive = re.compile(r'^\s*(\.\.\s+include::|:(file|url):)',
+            re.MULTILINE)
+
     class ReStructuredText(Renderer):
         """reStructuredText renderer."""
         extensions = ['rst']
@@ -109,6 +226,18 @@ try:
             overrides = { 'doctitle_xform': page_meta.get('rst_doctitle', cls.options['doctitle']), }
             return docutils.core.publish_parts(plain, writer=w, settings_overrides=overrides, source_path=page_meta['source_path'])['body']
 
+        @classmethod
+        def cache_options(cls, page_meta):
+            # Error messages in the output name the source file.
+            return repr((docutils.__version__,
+                page_meta.get('rst_doctitle', cls.options['doctitle']),
+                page_meta['source_path']))
+
+        @classmethod
+        def cacheable(cls, plain):
+            # The cache doesn't know when included files change.
+            return not rst_file_directive.search(plain)
+
     all.append(ReStructuredText)
 except ImportError:
     logging.warn('reStructuredText not enabled.')
@@ -125,6 +254,10 @@ try:
         def render(cls, plain, page_meta):
             return textile.textile(plain)
 
+        @classmethod
+        def cache_options(cls, page_meta):
+            return repr(getattr(textile, '__version__', None))
+
     all.append(Textile)
 except ImportError:
     logging.warn('Textile not enabled.')
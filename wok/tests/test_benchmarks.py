@@ -0,0 +1,92 @@
+import os
+import shutil
+import tempfile
+
+try:
+    from twisted.trial.unittest import TestCase
+except ImportError:
+    from unittest import TestCase
+
+from benchmarks import build, micro, regress, sitegen
+
+
+class TestBenchmarks(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.site = os.path.join(self.tmp_path, 'site')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_generate_site(self):
+        counts = sitegen.generate_site(self.site, pages=20, tags=5,
+                categories=2, category_depth=2, lists=3, list_limit=5,
+                rst_fraction=0.5, media_files=3, media_size=10)
+        self.assertEqual(counts['markdown'] + counts['rst'], 20)
+        self.assertEqual(counts['category'], 6)
+        self.assertEqual(counts['list'], 3)
+
+        with open(os.path.join(self.site, 'content', 'list1.mkd')) as f:
+            first = f.read()
+        sitegen.generate_site(self.site, pages=20, tags=5, categories=2,
+                category_depth=2, lists=3, list_limit=5, rst_fraction=0.5,
+                media_files=3, media_size=10)
+        with open(os.path.join(self.site, 'content', 'list1.mkd')) as f:
+            self.assertEqual(f.read(), first)
+
+    def test_build(self):
+        sitegen.generate_site(self.site, pages=20, tags=5, categories=2,
+                lists=2, list_limit=5, media_files=2, media_size=10)
+        results = build.build(self.site)
+        # The pages, the 6 category pages, and 2 lists of at least 1 page.
+        self.assertTrue(results['pages'] >= 28)
+        self.assertIn('load_pages', [p['name'] for p in results['phases']])
+        self.assertTrue(os.path.isfile(os.path.join(self.site, 'output',
+            'list0.html')))
+
+    def test_micro(self):
+        results = micro.run(number=10)
+        self.assertEqual([name for name, usec in results],
+                [name for name, setup in micro.BENCHMARKS])
+
+
+class TestRegress(TestCase):
+
+    baseline = {'sites': {
+        'small': {'pages': 100, 'pages_per_cpu_second': 100.0,
+            'peak_rss_kb': 1000},
+        'large': {'pages': 1000, 'pages_per_cpu_second': 200.0,
+            'peak_rss_kb': 2000},
+    }}
+
+    def results(self, small, large):
+        return {
+            'small': {'pages': 100, 'pages_per_cpu_second': small[0],
+                'peak_rss_kb': small[1]},
+            'large': {'pages': 1000, 'pages_per_cpu_second': large[0],
+                'peak_rss_kb': large[1]},
+        }
+
+    def test_no_regressions(self):
+        self.assertEqual(regress.compare(self.baseline,
+            self.results((90.0, 1100), (190.0, 2100)), 0.2), [])
+
+    def test_slower(self):
+        regressions = regress.compare(self.baseline,
+                self.results((70.0, 1000), (140.0, 2000)), 0.2)
+        self.assertEqual(len(regressions), 2)
+        self.assertTrue(regressions[0].startswith('large: 140.0 pages/CPU s'))
+
+    def test_more_memory(self):
+        regressions = regress.compare(self.baseline,
+                self.results((100.0, 1000), (200.0, 3000)), 0.2)
+        self.assertEqual(regressions, ['large: peak RSS 3000 kB, baseline '
+            '2000 kB'])
+
+    def test_scaling(self):
+        # Within tolerance on its own, but large sites got slower than small.
+        regressions = regress.compare(self.baseline,
+                self.results((115.0, 1000), (170.0, 2000)), 0.2)
+        self.assertEqual(len(regressions), 1)
+        self.assertIn('times the throughput of small', regressions[0])
@@ -1,7 +1,9 @@
+import logging
 import os
 import shutil
 import sys
 import tempfile
+from datetime import datetime
 
 try:
     from twisted.trial.unittest import TestCase
@@ -10,6 +12,8 @@ except ImportError:
 
 from wok import renderers
 from wok.engine import Engine
+from wok.exceptions import WorkerError
+from wok.page import Page
 
 
 DefaultRenderers = {}
@@ -34,6 +38,386 @@ class TestEngine(TestCase):
             del sys.modules['__hooks__']
         if '__renderers__' in sys.modules:
             del sys.modules['__renderers__']
+        # Forget that there was no hooks or renderers directory.
+        sys.path_importer_cache.pop('hooks', None)
+        sys.path_importer_cache.pop('renderers', None)
+
+    def make_site(self, config=''):
+        os.mkdir('templates')
+        with open(os.path.join('templates', 'default.html'), 'w') as f:
+            f.write('{{ page.title }} {{ site.pages|length }} '
+                    '{{ page.content }}')
+        with open(os.path.join('templates', 'list.html'), 'w') as f:
+            f.write('{% for p in pagination.page_items %}{{ p.slug }} '
+                    '{% endfor %}')
+
+        os.mkdir('content')
+        for name in 'abcdefg':
+            with open(os.path.join('content', name + '.mkd'), 'w') as f:
+                f.write('title: {0}\n---\n*{0}*\n'.format(name))
+        with open(os.path.join('content', 'list.mkd'), 'w') as f:
+            f.write('title: list\ntype: list\npagination:\n'
+                    '  list: site.pages\n  limit: 3\n  sort_key: slug\n'
+                    '---\n')
+
+        with open('config', 'w') as f:
+            f.write(config)
+
+    def generate_site(self):
+        Page.tmpl_env = None
+        e = Engine.__new__(Engine)
+        e.SITE_ROOT = self.tmp_path
+        e.generate_site()
+        return e
+
+    def read_output(self):
+        output = {}
+        for root, dirs, files in os.walk('output'):
+            for name in files:
+                path = os.path.join(root, name)
+                with open(path) as f:
+                    output[path] = f.read()
+        return output
+
+    def test_generate_site_parallel(self):
+        self.make_site()
+        self.generate_site()
+        serial = self.read_output()
+
+        with open('config', 'w') as f:
+            f.write('jobs: 3\n')
+        self.generate_site()
+
+        self.assertEqual(self.read_output(), serial)
+        self.assertIn('output/list2.html', serial)
+        self.assertIn('<em>a</em>', serial['output/a.html'])
+
+    def test_generate_site_parallel_errors(self):
+        self.make_site('jobs: 3\n')
+        with open(os.path.join('templates', 'default.html'), 'w') as f:
+            f.write('{% include "missing.html" %}')
+        # Used to hang, the TemplateNotFound couldn't be sent back.
+        self.assertRaises(WorkerError, self.generate_site)
+
+    def test_unchanged_output_not_rewritten(self):
+        self.make_site('media_sync: true\n')
+        e = self.generate_site()
+        self.assertEqual(e.modified_count, e.output_count)
+
+        os.utime(os.path.join('output', 'a.html'), (1000, 1000))
+        with open(os.path.join('content', 'b.mkd'), 'a') as f:
+            f.write('more\n')
+        e = self.generate_site()
+
+        self.assertEqual(e.modified_count, 1)
+        self.assertEqual(os.path.getmtime(os.path.join('output', 'a.html')),
+                1000)
+
+    def test_incremental_markup_deps(self):
+        for config in ('incremental: true\n', 'incremental: true\njobs: 3\n'):
+            self.make_site(config)
+            with open(os.path.join('templates', 'footer.html'), 'w') as f:
+                f.write('{{ page.title }} {{ site.slugs.footer.content }}')
+            with open(os.path.join('content', 'a.mkd'), 'w') as f:
+                f.write('title: a\ntype: footer\n---\n')
+            with open(os.path.join('content', 'footer.mkd'), 'w') as f:
+                f.write('title: footer\nmake_file: no\n---\nold footer\n')
+            self.generate_site()
+            self.assertIn('old footer', self.read_output()['output/a.html'])
+
+            # Only the body changes, so the metadata of the site doesn't.
+            with open(os.path.join('content', 'footer.mkd'), 'w') as f:
+                f.write('title: footer\nmake_file: no\n---\nnew footer\n')
+            e = self.generate_site()
+            self.assertIn('new footer', self.read_output()['output/a.html'])
+            self.assertEqual(e.modified_count, 1)
+
+            e = self.generate_site()
+            self.assertEqual(e.modified_count, 0)
+
+            for name in ('templates', 'content', 'output', '.wok-cache'):
+                shutil.rmtree(name)
+
+    def test_incremental_removed_source(self):
+        self.make_site('incremental: true\n')
+        self.generate_site()
+        self.assertTrue(os.path.isfile(os.path.join('output', 'b.html')))
+
+        os.unlink(os.path.join('content', 'b.mkd'))
+        self.generate_site()
+        output = self.read_output()
+        self.assertNotIn('output/b.html', output)
+        self.assertIn('output/a.html', output)
+
+    def test_staged_output_rename(self):
+        self.make_site('incremental: true\nstaged_output: rename\n')
+        self.generate_site()
+        first = self.read_output()
+        a_inode = os.stat(os.path.join('output', 'a.html')).st_ino
+
+        with open(os.path.join('content', 'b.mkd'), 'a') as f:
+            f.write('more\n')
+        self.generate_site()
+
+        self.assertFalse(os.path.exists('output.staging'))
+        self.assertFalse(os.path.exists('output.old'))
+        second = self.read_output()
+        self.assertEqual(set(first), set(second))
+        self.assertNotEqual(first['output/b.html'], second['output/b.html'])
+        # Unchanged files are carried over as hard links.
+        self.assertEqual(os.stat(os.path.join('output', 'a.html')).st_ino,
+                a_inode)
+
+    def test_staged_output_symlink(self):
+        self.make_site('staged_output: symlink\n')
+        os.mkdir('output')
+        with open(os.path.join('output', '.keep'), 'w') as f:
+            f.write('keep')
+
+        inodes = set()
+        for i in range(3):
+            self.generate_site()
+            self.assertTrue(os.path.islink('output'))
+            inodes.add(os.stat(os.path.join('output', 'a.html')).st_ino)
+
+        self.assertEqual(len(os.listdir('output.builds')), 2)
+        self.assertTrue(os.path.isfile(os.path.join('output', '.keep')))
+        self.assertIn('output/a.html', self.read_output())
+        # Without a manifest the output is rebuilt, not linked to.
+        self.assertEqual(len(inodes), 3)
+
+    def test_index_tags(self):
+        class FakePage(object):
+            def __init__(self, slug, tags, dt):
+                self.meta = {'slug': slug, 'tags': tags, 'datetime': dt}
+
+        e = Engine.__new__(Engine)
+        e.all_pages = [
+            FakePage('a', ['x', 'y', 'x'], datetime(2012, 1, 1)),
+            FakePage('b', ['y'], None),
+            FakePage('c', ['y'], datetime(2013, 1, 1)),
+            FakePage('d', [], datetime(2014, 1, 1)),
+        ]
+        tags, counts, by_date = e.index_tags()
+
+        self.assertEqual(counts, {'x': 1, 'y': 3})
+        self.assertEqual([m['slug'] for m in tags['y']], ['a', 'b', 'c'])
+        self.assertEqual([m['slug'] for m in by_date['y']], ['c', 'a', 'b'])
+
+    def test_make_tree(self):
+        class FakePage(object):
+            def __init__(self, slug, category):
+                self.path = slug
+                self.meta = {'slug': slug, 'category': category,
+                        'subpages': []}
+
+        e = Engine.__new__(Engine)
+        e.all_pages = [
+            FakePage('c', ['b']),
+            FakePage('b', []),
+            FakePage('a', ['b']),
+            FakePage('d', ['b', 'c']),
+            FakePage('orphan', ['x']),
+        ]
+        e.make_tree()
+
+        b = e.category_index['b']
+        self.assertEqual([m['slug'] for m in b['page']['subpages']],
+                ['c', 'a'])
+        self.assertEqual([n['path'] for n in b['children']], ['b/a', 'b/c'])
+        self.assertEqual(b['count'], 3)
+        self.assertEqual(e.category_index['b/c/d']['count'], 0)
+        self.assertEqual(e.category_index['']['count'], 4)
+        self.assertNotIn('x/orphan', e.category_index)
+        self.assertEqual(len(e.categories['b']), 3)
+
+    def test_template_vars_shared_site(self):
+        self.make_site()
+        e = Engine.__new__(Engine)
+        e.read_options()
+        e.all_pages = []
+        e.make_tree()
+        e.site_context = e.make_site_context()
+
+        first = e.template_vars()
+        second = e.template_vars(['a page'])
+        first['site']['extra'] = True
+
+        self.assertEqual(first['site']['datetime'], second['site']['datetime'])
+        self.assertEqual(first['site']['pages'], tuple(e.all_pages))
+        self.assertEqual(second['site']['pages'], ['a page'])
+        self.assertNotIn('extra', e.template_vars()['site'])
+
+    def test_pagination_shares_meta(self):
+        self.make_site()
+        e = self.generate_site()
+
+        pages = [p for p in e.all_pages if p.meta['slug'] == 'list']
+        self.assertEqual([p.meta['pagination']['cur_page'] for p in pages],
+                [1, 2, 3])
+        first, second = pages[0].meta, pages[1].meta
+        self.assertIs(second['tags'], first['tags'])
+        self.assertIsNot(second['pagination'], first['pagination'])
+        self.assertEqual(second['subpages'], [])
+        self.assertEqual(first['url'], '/list.html')
+        self.assertEqual(second['url'], '/list2.html')
+
+    def test_lazy_markup(self):
+        self.make_site()
+        self.generate_site()
+        eager = self.read_output()
+
+        with open('config', 'w') as f:
+            f.write('lazy_markup: true\n')
+        e = self.generate_site()
+
+        self.assertEqual(self.read_output(), eager)
+        a = [p for p in e.all_pages if p.meta['slug'] == 'a'][0]
+        self.assertTrue(dict.__contains__(a.meta, 'content'))
+        # No template uses the preview, so it was never rendered.
+        self.assertFalse(dict.__contains__(a.meta, 'preview'))
+
+    def test_template_cache(self):
+        self.make_site('template_cache: true\n')
+        self.generate_site()
+        first = self.read_output()
+
+        cache = os.path.join('.wok-cache', 'templates')
+        compiled = [f for root, dirs, files in os.walk(cache) for f in files]
+        self.assertEqual(len(compiled), 2)
+
+        self.generate_site()
+        self.assertEqual(self.read_output(), first)
+
+    def test_stream_output(self):
+        self.make_site('media_sync: true\n')
+        self.generate_site()
+        expected = self.read_output()
+
+        with open('config', 'a') as f:
+            f.write('stream_output: true\n')
+        e = self.generate_site()
+        self.assertEqual(self.read_output(), expected)
+        self.assertEqual(e.modified_count, 0)
+
+        os.mkdir('hooks')
+        with open(os.path.join('hooks', '__hooks__.py'), 'w') as f:
+            f.write('def post(options, page):\n'
+                    '    page.rendered += "!"\n'
+                    'hooks = {"page.template.post": [post]}\n')
+        sys.path_importer_cache.pop('hooks', None)
+        self.generate_site()
+        with open(os.path.join('output', 'a.html')) as f:
+            self.assertEqual(f.read(), expected['output/a.html'] + '!')
+
+    def test_stream_output_errors(self):
+        self.make_site('stream_output: true\n')
+        with open(os.path.join('templates', 'default.html'), 'w') as f:
+            f.write('{{ page.title }} {{ 1 / 0 }}')
+        self.assertRaises(ZeroDivisionError, self.generate_site)
+        self.assertEqual([name for name in os.listdir('output')
+                          if name.endswith('.tmp')], [])
+
+    def test_profile_pagination_hooks(self):
+        self.make_site()
+        os.mkdir('hooks')
+        with open(os.path.join('hooks', '__hooks__.py'), 'w') as f:
+            f.write('def post(options, page):\n'
+                    '    pass\n'
+                    'hooks = {"page.meta.post": [post]}\n')
+
+        Page.tmpl_env = None
+        e = Engine.__new__(Engine)
+        e.SITE_ROOT = self.tmp_path
+        e.profile = True
+        e.generate_site()
+
+        # The meta hooks of pagination pages count towards their source.
+        pages = e.profiler.pages()
+        self.assertNotIn('list', pages)
+        self.assertIn('page.meta.post',
+                pages[os.path.join('content', 'list.mkd')]['steps'])
+
+    def test_profile_failed_build(self):
+        self.make_site('low_memory: true\n')
+        with open(os.path.join('templates', 'list.html'), 'w') as f:
+            f.write('{{ 1 / 0 }}')
+
+        Page.tmpl_env = None
+        e = Engine.__new__(Engine)
+        e.SITE_ROOT = self.tmp_path
+        e.profile = True
+        self.assertRaises(ZeroDivisionError, e.generate_site)
+
+        self.assertTrue(os.path.isfile(os.path.join('.wok-cache', 'profile',
+            'trace.json')))
+        self.assertIsNone(e.spool)
+        self.assertEqual([name for name in os.listdir('.wok-cache')
+                          if name.startswith('spool')], [])
+
+    def test_low_memory(self):
+        self.make_site()
+        # The list shows the content of pages written before it, as changed
+        # by a hook.
+        with open(os.path.join('templates', 'list.html'), 'w') as f:
+            f.write('{% for p in pagination.page_items %}{{ p.content }}'
+                    '{{ p.content }}{% endfor %}')
+        os.mkdir('hooks')
+        with open(os.path.join('hooks', '__hooks__.py'), 'w') as f:
+            f.write('def post(options, page):\n'
+                    '    page.meta["content"] += "!"\n'
+                    'hooks = {"page.render.post": [post]}\n')
+        self.generate_site()
+        expected = self.read_output()
+        self.assertIn('<em>a</em></p>!', expected['output/list.html'])
+
+        with open('config', 'w') as f:
+            f.write('low_memory: true\n')
+        e = self.generate_site()
+        self.assertEqual(self.read_output(), expected)
+
+        for p in e.all_pages:
+            self.assertIsNone(p.rendered)
+            self.assertFalse(dict.__contains__(p.meta, 'content'))
+        a = [p for p in e.all_pages if p.meta['slug'] == 'a'][0]
+        self.assertIsNone(a.original)
+        self.assertEqual(sorted(a.spooled), ['content', 'original_preview'])
+        self.assertEqual(os.listdir('.wok-cache'), [])
+
+        # Pages are only released by the serial renderer.
+        with open('config', 'w') as f:
+            f.write('low_memory: true\njobs: 3\n')
+        e = self.generate_site()
+        self.assertEqual(e.options['jobs'], 1)
+        self.assertEqual(self.read_output(), expected)
+        self.assertTrue(all(p.rendered is None for p in e.all_pages))
+
+    def test_check_collisions(self):
+        self.make_site()
+        with open(os.path.join('content', 'a2.mkd'), 'w') as f:
+            f.write('title: a\nslug: a\n---\n')
+        with open(os.path.join('content', 'b2.mkd'), 'w') as f:
+            f.write('title: b2\nurl: /b.html\n---\n')
+
+        messages = []
+        handler = logging.Handler()
+        handler.emit = lambda record: messages.append(
+                (record.levelno, record.getMessage()))
+        logging.getLogger().addHandler(handler)
+        try:
+            self.generate_site()
+        finally:
+            logging.getLogger().removeHandler(handler)
+
+        # The files can be found in any order.
+        warnings = [m for level, m in messages if level == logging.WARNING
+                and 'have the same slug "a"' in m]
+        self.assertEqual(len(warnings), 1)
+        self.assertIn('content/a2.mkd', warnings[0])
+        errors = [m for level, m in messages if level == logging.ERROR
+                and 'would both be written to output/b.html' in m]
+        self.assertEqual(len(errors), 1)
+        self.assertIn('content/b2.mkd', errors[0])
 
     def test_load_hooks_no_hooks(self):
         e = Engine.__new__(Engine)
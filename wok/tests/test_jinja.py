@@ -0,0 +1,110 @@
+import os
+import shutil
+import tempfile
+
+try:
+    from twisted.trial.unittest import TestCase
+except ImportError:
+    from unittest import TestCase
+
+from jinja2 import Environment
+from jinja2.loaders import TemplateNotFound
+
+from wok.jinja import GlobFileLoader, CompiledLoader, AmbiguousTemplate
+from wok.jinja import compile_templates
+
+
+class TestGlobFileLoader(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        for name in ('default.html', 'list.xml', 'list.html', 'feed.xml',
+                'feed.xml.swp', '.hidden.html'):
+            self.write(name, name)
+        self.loader = GlobFileLoader(searchpath=self.tmp_path,
+                ignores=['*.swp'])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def write(self, name, contents):
+        with open(os.path.join(self.tmp_path, name), 'w') as f:
+            f.write(contents)
+
+    def test_get_source(self):
+        contents, filename, uptodate = self.loader.get_source(None,
+                'default.*')
+        self.assertEqual(contents, 'default.html')
+        self.assertEqual(filename, os.path.join(self.tmp_path, 'default.html'))
+        self.assertTrue(uptodate())
+
+    def test_ignores(self):
+        contents, filename, uptodate = self.loader.get_source(None, 'feed.*')
+        self.assertEqual(contents, 'feed.xml')
+
+    def test_ambiguous(self):
+        self.assertRaises(AmbiguousTemplate, self.loader.get_source, None,
+                'list.*')
+
+    def test_not_found(self):
+        self.assertRaises(TemplateNotFound, self.loader.get_source, None,
+                'missing.*')
+        self.assertRaises(TemplateNotFound, self.loader.get_source, None,
+                '*.hidden.html')
+
+    def test_refresh(self):
+        contents, filename, uptodate = self.loader.get_source(None,
+                'default.*')
+        self.loader.refresh()
+        self.assertTrue(uptodate())
+
+        self.write('other.html', 'other')
+        self.loader.refresh()
+        self.assertFalse(uptodate())
+        contents, filename, uptodate = self.loader.get_source(None, 'other.*')
+        self.assertEqual(contents, 'other')
+
+
+class TestCompiledLoader(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.templates = os.path.join(self.tmp_path, 'templates')
+        os.makedirs(os.path.join(self.templates, 'sub'))
+        for name, contents in [
+                ('base.html', '<b>{% block body %}{% endblock %}</b>'),
+                ('default.html', '{% extends "base.html" %}'
+                    '{% block body %}{{ x }}{% endblock %}'),
+                ('list.html', ''), ('list.xml', ''),
+                ('default.html.swp', '{% broken'),
+                (os.path.join('sub', 'feed.xml'), '<feed/>')]:
+            with open(os.path.join(self.templates, name), 'w') as f:
+                f.write(contents)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def compile(self, target):
+        env = Environment(loader=GlobFileLoader(searchpath=self.templates,
+            ignores=['*.swp']))
+        names = compile_templates(env, target, ['*.swp'])
+        self.assertNotIn('default.html.swp', names)
+        return Environment(loader=CompiledLoader(target))
+
+    def check(self, env):
+        template = env.get_template('default.*')
+        self.assertEqual(template.render(x=1), '<b>1</b>')
+        self.assertEqual(template.filename, 'default.html')
+        self.assertEqual(env.get_template('sub/feed.*').render(), '<feed/>')
+        self.assertRaises(AmbiguousTemplate, env.get_template, 'list.*')
+        self.assertRaises(TemplateNotFound, env.get_template, 'missing.*')
+
+    def test_directory(self):
+        self.check(self.compile(os.path.join(self.tmp_path, 'compiled')))
+
+    def test_zip(self):
+        self.check(self.compile(os.path.join(self.tmp_path, 'compiled.zip')))
+
+    def test_missing(self):
+        self.assertRaises(SystemExit, CompiledLoader,
+                os.path.join(self.tmp_path, 'compiled'))
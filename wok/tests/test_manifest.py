@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+
+try:
+    from twisted.trial.unittest import TestCase
+except ImportError:
+    from unittest import TestCase
+
+from wok.manifest import BuildManifest, digest
+
+
+class TestBuildManifest(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_path, 'cache', 'manifest.json')
+        self.root = os.path.join(self.tmp_path, 'output')
+        os.mkdir(self.root)
+        self.output = os.path.join(self.root, 'index.html')
+        with open(self.output, 'w') as f:
+            f.write('hello')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def test_missing_manifest(self):
+        m = BuildManifest.load(self.path)
+        self.assertFalse(m)
+        self.assertIsNone(m.lookup('content/a.mkd', 'key'))
+
+    def test_round_trip(self):
+        m = BuildManifest.load(self.path, self.root)
+        m.record('content/a.mkd', 'key', [self.output], u'<p>a</p>', u'')
+        m.save()
+
+        m = BuildManifest.load(self.path, self.root)
+        self.assertTrue(m)
+        entry = m.lookup('content/a.mkd', 'key')
+        self.assertEqual(entry['content'], u'<p>a</p>')
+        self.assertEqual(entry['outputs'], [self.output])
+
+        self.assertIsNone(m.lookup('content/a.mkd', 'other key'))
+        os.unlink(self.output)
+        self.assertIsNone(m.lookup('content/a.mkd', 'key'))
+
+    def test_deps(self):
+        m = BuildManifest.load(self.path, self.root)
+        m.record('content/a.mkd', 'key', [self.output],
+                deps={'content/footer.mkd': 'digest'})
+        m.save()
+
+        m = BuildManifest.load(self.path, self.root)
+        self.assertEqual(m.lookup('content/a.mkd', 'key')['deps'],
+                {'content/footer.mkd': 'digest'})
+
+    def test_moved_root(self):
+        m = BuildManifest.load(self.path, self.root)
+        m.record('content/a.mkd', 'key', [self.output])
+        m.save()
+
+        moved = os.path.join(self.tmp_path, 'moved')
+        os.rename(self.root, moved)
+        m = BuildManifest.load(self.path, moved)
+        self.assertEqual(m.lookup('content/a.mkd', 'key')['outputs'],
+                [os.path.join(moved, 'index.html')])
+
+    def test_stale_outputs(self):
+        m = BuildManifest.load(self.path, 'output')
+        m.record('content/a.mkd', 'key', ['output/a.html', 'output/a2.html'])
+        m.record('content/b.mkd', 'key', ['output/b.html'])
+        m.save()
+
+        m.record('content/a.mkd', 'key', ['output/a.html'])
+        m.record(None, outputs=['output/b.html'])
+        self.assertEqual(m.stale_outputs(), ['output/a2.html'])
+
+    def test_corrupt_manifest(self):
+        os.makedirs(os.path.dirname(self.path))
+        with open(self.path, 'w') as f:
+            f.write('{not json')
+
+        m = BuildManifest.load(self.path)
+        self.assertFalse(m)
+
+    def test_digest(self):
+        self.assertEqual(digest('a', u'b'), digest('a', 'b'))
+        self.assertNotEqual(digest('ab'), digest('a', 'b'))
@@ -0,0 +1,111 @@
+import os
+import shutil
+import tempfile
+
+try:
+    from twisted.trial.unittest import TestCase
+except ImportError:
+    from unittest import TestCase
+
+from wok import media
+
+
+class TestSyncTree(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmp_path, 'media')
+        self.dst = os.path.join(self.tmp_path, 'output')
+        os.makedirs(os.path.join(self.src, 'css'))
+        self.write(os.path.join(self.src, 'css', 'base.css'), 'body {}')
+        self.write(os.path.join(self.src, 'favicon.ico'), 'icon')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_path)
+
+    def write(self, path, text):
+        with open(path, 'w') as f:
+            f.write(text)
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_first_sync(self):
+        deployed, copied = media.sync_tree(self.src, self.dst)
+
+        self.assertEqual(copied, 2)
+        self.assertEqual(sorted(deployed), [
+            os.path.join(self.dst, 'css', 'base.css'),
+            os.path.join(self.dst, 'favicon.ico'),
+        ])
+        self.assertEqual(self.read(os.path.join(self.dst, 'css', 'base.css')),
+                'body {}')
+
+    def test_only_changed_files(self):
+        media.sync_tree(self.src, self.dst)
+        self.write(os.path.join(self.dst, 'page.html'), 'page')
+        self.write(os.path.join(self.src, 'favicon.ico'), 'new icon')
+
+        deployed, copied = media.sync_tree(self.src, self.dst)
+
+        self.assertEqual(copied, 1)
+        self.assertEqual(self.read(os.path.join(self.dst, 'favicon.ico')),
+                'new icon')
+        # Files that aren't media are left alone.
+        self.assertEqual(self.read(os.path.join(self.dst, 'page.html')),
+                'page')
+
+    def test_checksum(self):
+        media.sync_tree(self.src, self.dst)
+        # Same size and mtime, different contents.
+        path = os.path.join(self.src, 'favicon.ico')
+        st = os.stat(path)
+        self.write(path, 'ICON')
+        os.utime(path, (st.st_atime, st.st_mtime))
+
+        self.assertEqual(media.sync_tree(self.src, self.dst)[1], 0)
+        self.assertEqual(media.sync_tree(self.src, self.dst, True)[1], 1)
+        self.assertEqual(self.read(os.path.join(self.dst, 'favicon.ico')),
+                'ICON')
+
+    def test_symlinks(self):
+        os.symlink('favicon.ico', os.path.join(self.src, 'icon.ico'))
+        media.sync_tree(self.src, self.dst)
+
+        link = os.path.join(self.dst, 'icon.ico')
+        self.assertTrue(os.path.islink(link))
+        self.assertEqual(os.readlink(link), 'favicon.ico')
+        self.assertEqual(media.sync_tree(self.src, self.dst)[1], 0)
+
+    def test_hardlink(self):
+        media.sync_tree(self.src, self.dst, mode='hardlink')
+
+        self.assertTrue(os.path.samefile(
+            os.path.join(self.src, 'favicon.ico'),
+            os.path.join(self.dst, 'favicon.ico')))
+        self.assertEqual(
+                media.sync_tree(self.src, self.dst, mode='hardlink')[1], 0)
+
+    def test_symlink_mode(self):
+        media.sync_tree(self.src, self.dst, mode='symlink')
+
+        link = os.path.join(self.dst, 'css', 'base.css')
+        self.assertEqual(os.readlink(link),
+                os.path.abspath(os.path.join(self.src, 'css', 'base.css')))
+        self.assertEqual(
+                media.sync_tree(self.src, self.dst, mode='symlink')[1], 0)
+
+    def test_switch_mode(self):
+        media.sync_tree(self.src, self.dst, mode='symlink')
+        media.sync_tree(self.src, self.dst, mode='copy')
+
+        path = os.path.join(self.dst, 'favicon.ico')
+        self.assertFalse(os.path.islink(path))
+        self.assertEqual(self.read(path), 'icon')
+
+    def test_fallback_to_copy(self):
+        media.deploy_file(os.path.join(self.src, 'favicon.ico'),
+                os.path.join(self.tmp_path, 'icon.ico'), mode='reflink')
+        self.assertEqual(self.read(os.path.join(self.tmp_path, 'icon.ico')),
+                'icon')
@@ -3,7 +3,7 @@ try:
 except ImportError:
     from unittest import TestCase
 
-from wok.page import Author
+from wok.page import Author, Page
 
 class TestAuthor(TestCase):
 
@@ -20,3 +20,16 @@ class TestAuthor(TestCase):
         a = Author.parse('<bob@here.com>')
         self.assertEqual(a.raw, '<bob@here.com>')
         self.assertEqual(a.email, 'bob@here.com')
+
+class TestPage(TestCase):
+
+    def test_template_ext(self):
+        class FakeTemplate(object):
+            def __init__(self, filename):
+                self.filename = filename
+
+        self.assertEqual(Page.template_ext(FakeTemplate('t/default.html')),
+                'html')
+        self.assertEqual(Page.template_ext(FakeTemplate('t/feed.xml')), 'xml')
+        self.assertEqual(Page.template_ext(FakeTemplate('t/plain')), '')
+        self.assertEqual(Page.template_exts['t/feed.xml'], 'xml')
@@ -0,0 +1,129 @@
+import os
+import json
+import shutil
+import tempfile
+
+try:
+    from twisted.trial.unittest import TestCase
+except ImportError:
+    from unittest import TestCase
+
+from wok.profiler import Profiler, HookStats
+
+
+class TestProfiler(TestCase):
+
+    def setUp(self):
+        self.profiler = Profiler()
+        with self.profiler.span('load_pages'):
+            for page in ('a.mkd', 'b.mkd'):
+                with self.profiler.span('read', 'page', page):
+                    pass
+                with self.profiler.span('markup', 'page', page):
+                    sum(range(10000 if page == 'b.mkd' else 1))
+            with self.profiler.span('page.render.pre', 'hook', 'b.mkd'):
+                pass
+
+    def test_phases(self):
+        self.assertEqual([p['name'] for p in self.profiler.phases()],
+                ['load_pages'])
+
+    def test_pages(self):
+        pages = self.profiler.pages()
+        self.assertEqual(sorted(pages), ['a.mkd', 'b.mkd'])
+        self.assertEqual(sorted(pages['b.mkd']['steps']),
+                ['markup', 'page.render.pre', 'read'])
+        b = pages['b.mkd']
+        self.assertAlmostEqual(b['wall'],
+                sum(s['wall'] for s in b['steps'].values()))
+        self.assertEqual(self.profiler.slowest_pages(1)[0][0], 'b.mkd')
+
+    def test_nested_pages(self):
+        profiler = Profiler()
+        with profiler.span('meta', 'page', 'a.mkd'):
+            with profiler.span('page.meta.post', 'hook', 'a.mkd'):
+                sum(range(10000))
+        with profiler.span('template', 'page', 'a.mkd'):
+            # Lazy markup of another page, rendered by this page's template.
+            with profiler.span('markup', 'page', 'b.mkd'):
+                sum(range(10000))
+
+        pages = profiler.pages()
+        events = dict(((e['name'], e['page']), e) for e in profiler.events)
+        a = pages['a.mkd']
+        self.assertAlmostEqual(a['wall'], events['meta', 'a.mkd']['wall'] +
+                events['template', 'a.mkd']['wall'] -
+                events['markup', 'b.mkd']['wall'])
+        self.assertAlmostEqual(a['steps']['meta']['wall'] +
+                a['steps']['page.meta.post']['wall'],
+                events['meta', 'a.mkd']['wall'])
+        self.assertAlmostEqual(pages['b.mkd']['wall'],
+                events['markup', 'b.mkd']['wall'])
+
+    def test_trace(self):
+        events = self.profiler.trace()['traceEvents']
+        self.assertEqual(len(events), 6)
+        self.assertTrue(all(e['ph'] == 'X' for e in events))
+        phase = [e for e in events if e['cat'] == 'phase'][0]
+        for e in events:
+            self.assertTrue(phase['ts'] <= e['ts'])
+            self.assertTrue(e['ts'] + e['dur'] <= phase['ts'] + phase['dur'])
+
+    def test_save(self):
+        tmp_path = tempfile.mkdtemp()
+        try:
+            profile_path, trace_path, hooks_path = self.profiler.save(
+                    os.path.join(tmp_path, 'profile'))
+            with open(profile_path) as f:
+                self.assertEqual(sorted(json.load(f)), ['pages', 'phases'])
+            with open(trace_path) as f:
+                self.assertIn('traceEvents', json.load(f))
+            with open(hooks_path) as f:
+                self.assertEqual(sorted(json.load(f)), ['callables', 'hooks'])
+        finally:
+            shutil.rmtree(tmp_path)
+
+    def test_report(self):
+        report = self.profiler.report()
+        self.assertIn('load_pages', report)
+        self.assertIn('b.mkd', report)
+
+
+def good_hook(config, page):
+    return page
+
+
+class BadHook(object):
+    def __call__(self, config, page):
+        raise ValueError(page)
+
+
+class TestHookStats(TestCase):
+
+    def setUp(self):
+        self.stats = HookStats()
+
+    def test_call(self):
+        for page in ('a', 'b'):
+            self.assertEqual(self.stats.call('page.render.pre', good_hook,
+                {}, page), page)
+        self.assertRaises(ValueError, self.stats.call, 'page.render.pre',
+                BadHook(), {}, 'c')
+
+        hooks = self.stats.stats['page.render.pre']
+        good = hooks[__name__ + '.good_hook']
+        self.assertEqual(good['calls'], 2)
+        self.assertEqual(good['errors'], 0)
+        self.assertTrue(good['max'] <= good['total'])
+        self.assertEqual(hooks[__name__ + '.BadHook']['errors'], 1)
+
+        totals = self.stats.totals()['page.render.pre']
+        self.assertEqual(totals['calls'], 3)
+        self.assertEqual(totals['errors'], 1)
+
+    def test_slowest(self):
+        self.stats.record('site.start', 'fast', 0.1)
+        self.stats.record('site.done', 'slow', 0.2)
+        self.stats.record('site.done', 'slow', 0.2)
+        self.assertEqual([(h, n) for h, n, s in self.stats.slowest(2)],
+                [('site.done', 'slow'), ('site.start', 'fast')])
@@ -0,0 +1,107 @@
+# vim: set fileencoding=utf8 :
+import os
+import shutil
+import tempfile
+
+try:
+    from twisted.trial.unittest import TestCase
+except ImportError:
+    from unittest import TestCase
+
+from wok import renderers
+
+
+class CountingRenderer(renderers.Renderer):
+    calls = 0
+    option = 'a'
+
+    @classmethod
+    def render(cls, plain, page_meta):
+        cls.calls += 1
+        return plain.upper()
+
+    @classmethod
+    def cache_options(cls, page_meta):
+        return cls.option
+
+
+class TestRenderCache(TestCase):
+
+    def setUp(self):
+        self.tmp_path = tempfile.mkdtemp()
+        self.cache = renderers.RenderCache(self.tmp_path)
+        renderers.cache = self.cache
+        CountingRenderer.calls = 0
+        CountingRenderer.option = 'a'
+
+    def tearDown(self):
+        renderers.cache = None
+        shutil.rmtree(self.tmp_path)
+
+    def test_get_set(self):
+        self.assertIsNone(self.cache.get('abcdef'))
+        self.cache.set('abcdef', u'中文')
+        self.assertEqual(self.cache.get('abcdef'), u'中文')
+
+    def test_render_hit(self):
+        self.assertEqual(renderers.render(CountingRenderer, u'hi', {}), u'HI')
+        self.assertEqual(renderers.render(CountingRenderer, u'hi', {}), u'HI')
+        self.assertEqual(CountingRenderer.calls, 1)
+
+        renderers.render(CountingRenderer, u'ho', {})
+        self.assertEqual(CountingRenderer.calls, 2)
+
+    def test_render_options(self):
+        renderers.render(CountingRenderer, u'hi', {})
+        CountingRenderer.option = 'b'
+        renderers.render(CountingRenderer, u'hi', {})
+        self.assertEqual(CountingRenderer.calls, 2)
+
+    def test_uncacheable_renderer(self):
+        calls = []
+
+        class Custom(object):
+            @staticmethod
+            def render(plain, page_meta):
+                calls.append(plain)
+                return plain
+
+        renderers.render(Custom, u'hi', {})
+        renderers.render(Custom, u'hi', {})
+        self.assertEqual(len(calls), 2)
+
+    def test_base_renderer_uncached(self):
+        self.assertFalse(hasattr(renderers.Renderer, 'cache_options'))
+        self.assertTrue(hasattr(renderers.Plain, 'cache_options'))
+
+    def test_rst_includes_uncached(self):
+        if not hasattr(renderers, 'ReStructuredText'):
+            return
+        rst = renderers.ReStructuredText
+        include = os.path.join(self.tmp_path, 'included.rst')
+        meta = {'source_path': os.path.join(self.tmp_path, 'page.rst')}
+        plain = u'Before\n\n.. include:: included.rst\n'
+
+        with open(include, 'w') as f:
+            f.write('old text\n')
+        self.assertIn(u'old text', renderers.render(rst, plain, meta))
+        with open(include, 'w') as f:
+            f.write('new text\n')
+        self.assertIn(u'new text', renderers.render(rst, plain, meta))
+
+        self.assertTrue(rst.cacheable(u'No includes here.\n'))
+        self.assertFalse(rst.cacheable(u'.. raw:: html\n   :file: a.html\n'))
+
+    def test_prune(self):
+        self.cache.max_size = 25
+        for i, key in enumerate(['aa1', 'bb2', 'cc3']):
+            self.cache.set(key, u'0123456789')
+            os.utime(self.cache.path(key), (1000 + i, 1000 + i))
+
+        # Reading an entry makes it the most recently used.
+        self.cache.get('aa1')
+        self.cache.prune()
+
+        self.assertIsNotNone(self.cache.get('aa1'))
+        self.assertIsNone(self.cache.get('bb2'))
+        self.assertIsNotNone(self.cache.get('cc3'))
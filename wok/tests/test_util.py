@@ -3,9 +3,14 @@ try:
 except ImportError:
     from unittest import TestCase
 
+import os
+import tempfile
 from datetime import date, time, datetime, tzinfo
 
+from jinja2 import TemplateNotFound
+
 from wok import util
+from wok.exceptions import WorkerError
 
 class TestDatetimes(TestCase):
 
@@ -135,3 +140,82 @@ class TestDatetimes(TestCase):
 
         util.date_and_times(inp)
         self.assertEquals(inp, out)
+
+class TestForkMap(TestCase):
+
+    def test_order(self):
+        items = range(50)
+        self.assertEqual(util.fork_map(lambda x: x * x, items, 4),
+                [x * x for x in items])
+
+    def test_errors(self):
+        def fail(x):
+            if x == 3:
+                raise ValueError(x)
+            return x
+
+        try:
+            util.fork_map(fail, range(5), 2)
+        except WorkerError as e:
+            self.assertEqual(e.type_name, 'ValueError')
+            self.assertIn('raise ValueError(x)', e.traceback)
+        else:
+            self.fail('fork_map did not raise')
+
+    def test_unpicklable_errors(self):
+        # TemplateNotFound can't be unpickled, which used to hang the pool.
+        def fail(x):
+            raise TemplateNotFound('missing.html')
+
+        self.assertRaises(WorkerError, util.fork_map, fail, range(5), 2)
+
+class TestSameContents(TestCase):
+
+    def test_same_contents(self):
+        fd, path = tempfile.mkstemp()
+        os.write(fd, 'hello')
+        os.close(fd)
+        try:
+            self.assertTrue(util.same_contents(path, 'hello'))
+            self.assertFalse(util.same_contents(path, 'hellp'))
+            self.assertFalse(util.same_contents(path, 'hello!'))
+            self.assertFalse(util.same_contents(path + '.missing', 'hello'))
+        finally:
+            os.unlink(path)
+
+    def test_same_files(self):
+        paths = []
+        for contents in ('hello', 'hello', 'hellp'):
+            fd, path = tempfile.mkstemp()
+            os.write(fd, contents)
+            os.close(fd)
+            paths.append(path)
+        try:
+            self.assertTrue(util.same_files(paths[0], paths[1]))
+            self.assertFalse(util.same_files(paths[0], paths[2]))
+            self.assertFalse(util.same_files(paths[0], paths[0] + '.missing'))
+        finally:
+            for path in paths:
+                os.unlink(path)
+
+class TestSpool(TestCase):
+
+    def test_spool(self):
+        path = tempfile.mktemp()
+        spool = util.Spool(path)
+        first = spool.put(u'caf\xe9')
+        second = spool.put('plain')
+        self.assertEqual(spool.get(second), u'plain')
+        self.assertEqual(spool.get(first), u'caf\xe9')
+        self.assertEqual(spool.get(spool.put(u'')), u'')
+        spool.close()
+        self.assertFalse(os.path.exists(path))
+
+class TestYaml(TestCase):
+
+    def test_load_yaml(self):
+        self.assertEqual(util.load_yaml('title: Hi\ntags: [a, b]\n'),
+                {'title': 'Hi', 'tags': ['a', 'b']})
+        self.assertEqual(util.load_yaml('date: 2011-10-12'),
+                {'date': date(2011, 10, 12)})
+        self.assertIsNone(util.load_yaml(''))
@@ -1,7 +1,115 @@
+import os
+import multiprocessing
 import re
+import traceback
 from unicodedata import normalize
 from datetime import date, time, datetime, timedelta
 
+import yaml
+
+from wok.exceptions import WorkerError
+
+# Use libyaml when PyYAML was built with it, it is much faster.
+try:
+    from yaml import CSafeLoader as YamlLoader
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# The function and items of the running `fork_map`, inherited by its workers.
+_fork_map_state = None
+
+def _fork_map_call(idx):
+    # Many exceptions, like Jinja's, can't be unpickled, which makes the pool
+    # hang. Send back their type and traceback as text instead.
+    func, items = _fork_map_state
+    try:
+        return True, func(items[idx])
+    except Exception as e:
+        return False, (type(e).__name__, traceback.format_exc())
+
+def fork_map(func, items, processes):
+    """
+    Like `map(func, items)`, but spread over a pool of `processes` forked
+    worker processes. The workers inherit `func` and `items`, so only the
+    indexes of the items and the results have to be pickled. The results are
+    in the same order as `items`. If `func` raises an exception, a
+    `WorkerError` with its traceback is raised.
+    """
+    global _fork_map_state
+    _fork_map_state = (func, items)
+    pool = multiprocessing.Pool(processes)
+    try:
+        results = pool.map(_fork_map_call, xrange(len(items)))
+        pool.close()
+        for ok, result in results:
+            if not ok:
+                raise WorkerError(*result)
+        return [result for ok, result in results]
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+        _fork_map_state = None
+
+def load_yaml(stream):
+    """Parse the YAML document in the string or file `stream`."""
+    return yaml.load(stream, Loader=YamlLoader)
+
+def same_contents(path, data):
+    """Whether the file at `path` exists and contains exactly `data`."""
+    try:
+        if os.path.getsize(path) != len(data):
+            return False
+        with open(path, 'rb') as f:
+            return f.read() == data
+    except (IOError, OSError):
+        return False
+
+def same_files(path_a, path_b):
+    """Whether the files at `path_a` and `path_b` both exist and are equal."""
+    try:
+        if os.path.getsize(path_a) != os.path.getsize(path_b):
+            return False
+        with open(path_a, 'rb') as a:
+            with open(path_b, 'rb') as b:
+                while True:
+                    block = a.read(1 << 16)
+                    if block != b.read(1 << 16):
+                        return False
+                    if not block:
+                        return True
+    except (IOError, OSError):
+        return False
+
+class Spool(object):
+    """
+    Text kept in a file instead of in memory. `put` appends a string to the
+    file and returns a reference to it, which `get` reads it back with. The
+    file is removed by `close`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w+b')
+
+    def put(self, text):
+        if isinstance(text, unicode):
+            text = text.encode('utf-8')
+        self.file.seek(0, os.SEEK_END)
+        offset = self.file.tell()
+        self.file.write(text)
+        return offset, len(text)
+
+    def get(self, ref):
+        offset, length = ref
+        self.file.seek(offset)
+        return self.file.read(length).decode('utf-8')
+
+    def close(self):
+        self.file.close()
+        os.unlink(self.path)
+
 def chunk(li, n):
     """Yield succesive n-size chunks from l."""
     for i in xrange(0, len(li), n):